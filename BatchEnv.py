@@ -0,0 +1,217 @@
+import numpy as np
+from QLearner import QLearningPlayer
+
+EMPTY = 0
+X = 1
+O = -1
+
+# board values to the characters of Game.board; -1 indexes the last one
+_CHARS = np.array(['_', 'X', 'O'])
+
+
+class BatchGame:
+    """
+    N copies of the board game stepped together with NumPy.
+
+    boards has shape (N, rows, cols) with 1 for 'X', -1 for 'O' and 0 for an
+    empty square. score and rewards hold the same values Game.score and
+    Game.rewards would after the same moves, and turn holds the side to move
+    of every game. Move masks have shape (N, rows, cols, 3) where the last axis
+    is the horizontal move -1, 0, 1, matching Game.get_available_moves.
+    """
+
+    def __init__(self, n, row, col):
+        if row < 3 or col < 3:
+            raise ValueError("board too small")
+        self.n = n
+        self.total_row = row
+        self.total_col = col
+        self.boards = np.zeros((n, row, col), dtype=np.int8)
+        self.score = np.zeros(n, dtype=np.int64)
+        self.rewards = np.zeros((n, 2), dtype=np.int64)
+        self.turn = np.zeros(n, dtype=np.int8)
+        self.reset()
+
+    def reset(self, idx=None):
+        """
+        Put the games in idx (all games by default) back to the start position
+        with 'X' to move
+        """
+        if idx is None:
+            idx = np.arange(self.n)
+        self.boards[idx] = EMPTY
+        self.boards[idx, 0, :] = O
+        self.boards[idx, -1, :] = X
+        self.score[idx] = 0
+        self.rewards[idx] = 0
+        self.turn[idx] = X
+
+    def available_moves_mask(self, side, idx=None):
+        """
+        :param: side ('X' or 'O'), idx of the games (all by default)
+        :return: boolean array (len(idx), rows, cols, 3) of the legal moves
+        """
+        boards = self.boards if idx is None else self.boards[idx]
+        value = X if side == 'X' else O
+        own = boards == value
+        free = ~own
+        mask = np.zeros(boards.shape + (3,), dtype=bool)
+        if side == 'X':
+            # 'X' moves up a row, pieces on row 0 cannot move
+            mask[:, 1:, 1:, 0] = own[:, 1:, 1:] & free[:, :-1, :-1]
+            mask[:, 1:, :, 1] = own[:, 1:, :] & free[:, :-1, :]
+            mask[:, 1:, :-1, 2] = own[:, 1:, :-1] & free[:, :-1, 1:]
+        else:
+            mask[:, :-1, 1:, 0] = own[:, :-1, 1:] & free[:, 1:, :-1]
+            mask[:, :-1, :, 1] = own[:, :-1, :] & free[:, 1:, :]
+            mask[:, :-1, :-1, 2] = own[:, :-1, :-1] & free[:, 1:, 1:]
+        return mask
+
+    def get_available_moves(self, side, idx):
+        """
+        Return the legal moves of each game in idx as lists of
+        ((row, col), horizontal_move) in the order of Game.get_available_moves
+        """
+        return self.get_moves_and_codes(side, idx)[0]
+
+    def get_moves_and_codes(self, side, idx):
+        """
+        Return get_available_moves of the games in idx and, in the same
+        lists, the QTable.encode_action codes of the moves, computed for all
+        games at once
+        """
+        mask = self.available_moves_mask(side, idx)
+        games, rows, cols, hs = np.nonzero(mask)
+        bounds = np.searchsorted(games, np.arange(len(idx) + 1)).tolist()
+        moves = list(zip(zip(rows.tolist(), cols.tolist()), (hs - 1).tolist()))
+        codes = ((rows << 12) | (cols << 2) | hs).tolist()
+        return ([moves[bounds[i]:bounds[i + 1]] for i in range(len(idx))],
+                [codes[bounds[i]:bounds[i + 1]] for i in range(len(idx))])
+
+    def make_moves(self, idx, rows, cols, hs):
+        """
+        Make one move in each game in idx and update score and rewards like
+        Game.make_move. All moves must be legal and made by the same side.
+        """
+        idx = np.asarray(idx)
+        rows = np.asarray(rows)
+        cols = np.asarray(cols)
+        hs = np.asarray(hs)
+        if not len(idx):
+            return
+        value = self.boards[idx, rows, cols]
+        is_x = value == X
+        dst_rows = np.where(is_x, rows - 1, rows + 1)
+        dst_cols = cols + hs
+        captured = (self.boards[idx, dst_rows, dst_cols] == -value).astype(np.int64)
+        promoted = np.where(is_x, rows == 1, rows == self.total_row - 2).astype(np.int64)
+
+        self.boards[idx, rows, cols] = EMPTY
+        self.boards[idx, dst_rows, dst_cols] = value
+
+        x_captures = captured * is_x
+        o_captures = captured * ~is_x
+        x_promotions = promoted * is_x
+        o_promotions = promoted * ~is_x
+        self.score[idx] += x_captures - o_captures + 5 * (x_promotions - o_promotions)
+        self.rewards[idx, 0] += 20 * x_captures - 50 * o_captures + 100 * (x_promotions - o_promotions)
+        self.rewards[idx, 1] += -20 * x_captures + 50 * o_captures + 100 * (o_promotions - x_promotions)
+
+    def game_finish(self, side, idx=None):
+        """
+        :param: side, idx of the games (all by default)
+        :return: boolean array, True where Game.game_finish(side) would be
+        """
+        boards = self.boards if idx is None else self.boards[idx]
+        no_x = ~(boards == X).any(axis=(1, 2))
+        no_o = ~(boards == O).any(axis=(1, 2))
+        if side == 'X':
+            arrived = (boards[:, 0, :] == X).any(axis=1)
+        else:
+            arrived = (boards[:, -1, :] == O).any(axis=1)
+        return no_x | no_o | arrived
+
+    def get_states(self, idx):
+        """
+        Return the state of each game in idx in the same form as Game.get_state
+        """
+        chars = _CHARS[self.boards[idx]].tolist()
+        return [tuple(map(tuple, board)) for board in chars]
+
+    def get_state_codes(self, idx):
+        """
+        Return the integer code (see QTable.encode_state) of each game in idx
+        """
+        num_cells = self.total_row * self.total_col
+        cells = self.boards[idx].reshape(len(idx), num_cells)
+        codes = [0] * len(idx)
+        # int64 holds 62 cells at a time, wider boards are encoded in chunks
+        for start in range(0, num_cells, 62):
+            chunk = cells[:, start:start + 62]
+            weights = np.left_shift(1, np.arange(chunk.shape[1], dtype=np.int64))
+            x_bits = ((chunk == X).astype(np.int64) @ weights).tolist()
+            o_bits = ((chunk == O).astype(np.int64) @ weights).tolist()
+            codes = [code | (x << start) | (o << (num_cells + start)) for code, x, o in zip(codes, x_bits, o_bits)]
+        return codes
+
+
+def batch_q_learning_train(row, col, num_training_iter, batch_size=64, player1=None, player2=None):
+    """
+    :param: row, col, num_training_iter, batch_size, player1, player2
+    :return: the player with more wins, player1 ('X') or player2 ('O')
+
+    Train two QLearningPlayers like q_learning_train, but on batch_size games
+    at a time. Each step every game whose side is to move takes the same
+    complete_move step the player would take on a Game: choose an action,
+    make it and learn from the cumulative reward of its side. A finished
+    game is counted and replaced by a new one until num_training_iter games
+    have been played. The state and action codes of the Q-table keys are
+    computed for the whole batch with NumPy, and the players read their Q
+    values with them; the updates are still made one game at a time.
+    """
+    if player1 is None:
+        player1 = QLearningPlayer('X')
+    if player2 is None:
+        player2 = QLearningPlayer('O')
+
+    env = BatchGame(min(batch_size, num_training_iter), row, col)
+    started = env.n
+    finished = 0
+    active = np.ones(env.n, dtype=bool)
+    win_list = [0, 0]
+
+    while finished < num_training_iter:
+        for player, value, reward_idx in ((player1, X, 0), (player2, O, 1)):
+            idx = np.nonzero(active & (env.turn == value))[0]
+            if not len(idx):
+                continue
+            side = player.get_side()
+            actions_list, codes_list = env.get_moves_and_codes(side, idx)
+            moving = [i for i, actions in enumerate(actions_list) if actions]
+            if moving:
+                move_idx = idx[moving]
+                states = env.get_state_codes(move_idx)
+                chosen = player.choose_actions(states, [actions_list[i] for i in moving],
+                                               [codes_list[i] for i in moving])
+                env.make_moves(move_idx, [a[0][0] for a in chosen], [a[0][1] for a in chosen],
+                               [a[1] for a in chosen])
+                result_actions, result_codes = env.get_moves_and_codes(side, move_idx)
+                player.learn_batch(states, chosen, env.rewards[move_idx, reward_idx].tolist(),
+                                   env.get_state_codes(move_idx), result_actions, result_codes)
+
+            env.turn[idx] = -value
+            done = idx[env.game_finish(side, idx)]
+            for i in done.tolist():
+                rewards = env.rewards[i].tolist()
+                win_list[rewards.index(max(rewards))] += 1
+                finished += 1
+            if started < num_training_iter:
+                restart = done[:num_training_iter - started]
+                env.reset(restart)
+                started += len(restart)
+                done = done[len(restart):]
+            active[done] = False
+
+    if win_list.index(max(win_list)) == 0:
+        return player1
+    return player2
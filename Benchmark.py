@@ -0,0 +1,542 @@
+"""
+Benchmarks of the search and training hot paths across board sizes.
+
+    python3 Benchmark.py --out results.json
+    python3 Benchmark.py --quick --compare results.json
+
+Every benchmark runs on fixed positions made by seeded random play, so two
+runs measure the same work. Results are written as JSON; with --compare the
+run is checked against a stored baseline and regressions beyond the
+threshold are reported (exit status 1).
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+from BitboardGame import BitboardGame
+from Game import Game, minimax, alpha_beta, cuttingoff_search, q_learning_train
+from QLearner import QLearningPlayer
+from SearchStats import SearchStats, percentile
+from Evaluation import evaluate, evaluate_batch, to_array
+from Symmetry import Mirror
+from Solver import Solver, random_positions
+
+FULL = {
+    'sizes': [4, 6, 8, 10, 12],
+    'depths': {'minimax': [2, 3], 'alpha_beta': [2, 4], 'cuttingoff_search': [3, 4]},
+    'positions': 4,
+    'repeats': 5,
+    'training_games': 50,
+    'symmetry_plies': 4,
+    'quality': {'positions': 12, 'reference_depth': 5, 'depths': [2, 3, 4]},
+    'optimality': {'size': 4, 'positions': 100, 'depths': [2, 3, 4]},
+}
+
+QUICK = {
+    'sizes': [4, 8],
+    'depths': {'minimax': [2], 'alpha_beta': [3], 'cuttingoff_search': [3]},
+    'positions': 2,
+    'repeats': 3,
+    'training_games': 10,
+    'symmetry_plies': 3,
+    'quality': {'positions': 6, 'reference_depth': 4, 'depths': [2, 3]},
+    'optimality': {'size': 4, 'positions': 40, 'depths': [2, 3]},
+}
+
+# metrics where a higher value is better; all other compared metrics are lower-is-better
+THROUGHPUT = ('nodes_per_sec', 'moves_per_sec', 'games_per_sec', 'evals_per_sec', 'batch_evals_per_sec',
+              'steps_per_sec', 'optimal')
+COMPARED = THROUGHPUT + ('p50_ms', 'p99_ms', 'peak_kb', 'step_peak_bytes')
+
+
+def make_positions(size, count, seed, plies=None):
+    """
+    :param: size, count, seed, plies
+    :return: list of (moves, maxTurn)
+
+    Play random moves from the start position to get count positions, the
+    same ones for the same seed. The first position is the start position.
+    Each position is the list of moves that reaches it and whether 'O' is
+    to move; build_board turns it into a board.
+    """
+    rng = random.Random(seed * 100 + size)
+    if plies is None:
+        plies = size
+    positions = []
+    for idx in range(count):
+        g = Game(size, size)
+        side = 'X'
+        moves = []
+        for _ in range(rng.randint(0, plies) if idx else 0):
+            available = g.get_available_moves(side)
+            if not available:
+                break
+            move = rng.choice(available)
+            undo = g.make_move(move[0][0], move[0][1], move[1])
+            if g.game_finish(side):
+                g.undo_move(undo)
+                break
+            moves.append(move)
+            side = 'O' if side == 'X' else 'X'
+        positions.append((moves, side == 'O'))
+    return positions
+
+
+def build_board(size, moves, cls=Game):
+    """
+    Return a board of class cls after playing moves from the start position
+    """
+    board = cls(size, size)
+    for move in moves:
+        board.make_move(move[0][0], move[0][1], move[1])
+    return board
+
+
+def latency_stats(latencies):
+    return {
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def peak_memory(func):
+    """
+    Return the peak memory in KiB allocated while running func
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024.0
+    finally:
+        tracemalloc.stop()
+
+
+def run_search(name, size, depth, config, seed):
+    search = {'minimax': minimax, 'alpha_beta': alpha_beta, 'cuttingoff_search': cuttingoff_search}[name]
+
+    def call(board, maxTurn, stats=None):
+        if name == 'minimax':
+            return search(board, depth, maxTurn, stats)
+        return search(board, depth, maxTurn, -1000, 1000, stats=stats)
+
+    boards = [(build_board(size, moves), maxTurn) for moves, maxTurn in make_positions(size, config['positions'], seed)]
+    latencies = []
+    stats = SearchStats(trace_plies=-1)
+    for g, maxTurn in boards:
+        call(g, maxTurn, stats)
+        for _ in range(config['repeats']):
+            start = timeit.default_timer()
+            call(g, maxTurn)
+            latencies.append(timeit.default_timer() - start)
+
+    seconds = sum(latencies) / config['repeats']
+    result = {
+        'id': '{}/{}x{}/d{}'.format(name, size, size, depth),
+        'bench': name,
+        'size': size,
+        'depth': depth,
+        'nodes': stats.total_nodes(),
+        'nodes_per_sec': stats.total_nodes() / seconds if seconds else 0.0,
+        'cutoffs': sum(stats.cutoffs),
+        'peak_kb': peak_memory(lambda: [call(g, maxTurn) for g, maxTurn in boards]),
+    }
+    result.update(latency_stats(latencies))
+    return result
+
+
+def run_decision_quality(size, config, seed):
+    """
+    :param: size, config, seed
+    :return: list of result dicts, one per search and depth
+
+    Compare alpha_beta and cuttingoff_search by the moves they choose. Every
+    root move of each position is valued by an alpha_beta search to the
+    reference depth, and a search agrees when its move has the best of those
+    values. Node counts and latency can then be compared at equal agreement.
+    """
+    quality = config['quality']
+    positions = [(build_board(size, moves), maxTurn)
+                 for moves, maxTurn in make_positions(size, quality['positions'], seed, plies=2 * size)]
+    references = []
+    for g, maxTurn in positions:
+        values = {}
+        for move in g.get_available_moves('O' if maxTurn else 'X'):
+            undo = g.make_move(move[0][0], move[0][1], move[1])
+            values[move] = alpha_beta(g, quality['reference_depth'] - 1, not maxTurn, -1000, 1000)[1]
+            g.undo_move(undo)
+        references.append(values)
+
+    results = []
+    for name, search in (('alpha_beta', alpha_beta), ('cuttingoff_search', cuttingoff_search)):
+        for depth in quality['depths']:
+            stats = SearchStats(trace_plies=-1)
+            latencies = []
+            agree = 0
+            for (g, maxTurn), values in zip(positions, references):
+                start = timeit.default_timer()
+                move = search(g, depth, maxTurn, -1000, 1000, stats=stats)[0]
+                latencies.append(timeit.default_timer() - start)
+                best = max(values.values()) if maxTurn else min(values.values())
+                agree += values.get(move) == best
+            result = {
+                'id': 'quality/{}/{}x{}/d{}'.format(name, size, size, depth),
+                'bench': 'quality',
+                'search': name,
+                'size': size,
+                'depth': depth,
+                'reference_depth': quality['reference_depth'],
+                'agreement': agree / len(positions),
+                'nodes': stats.total_nodes(),
+            }
+            result.update(latency_stats(latencies))
+            results.append(result)
+    return results
+
+
+def run_optimality(config, seed):
+    """
+    :param: config, seed
+    :return: list of result dicts, one per search and depth
+
+    Check the root moves of alpha_beta and cuttingoff_search against the
+    exact values of Solver.move_values on a small board: optimal is the
+    fraction of positions where the search picks a move of the best exact
+    value, so --compare reports a search that starts picking worse moves
+    even when its root value is unchanged.
+    """
+    optimality = config['optimality']
+    size = optimality['size']
+    solver = Solver()
+    cases = []
+    for moves, maxTurn in random_positions(size, size, optimality['positions'], seed):
+        board = build_board(size, moves, BitboardGame)
+        values = solver.move_values(board, maxTurn)
+        available = board.get_available_moves('O' if maxTurn else 'X')
+        cases.append((moves, maxTurn, dict(zip(available, values)), max(values) if maxTurn else min(values)))
+
+    results = []
+    for name, search in (('alpha_beta', alpha_beta), ('cuttingoff_search', cuttingoff_search)):
+        for depth in optimality['depths']:
+            optimal = 0
+            loss = 0
+            for moves, maxTurn, values, best in cases:
+                move = search(build_board(size, moves), depth, maxTurn, -1000, 1000)[0]
+                value = values.get(move, min(values.values()) if maxTurn else max(values.values()))
+                optimal += value == best
+                loss += abs(best - value)
+            results.append({
+                'id': 'optimality/{}/{}x{}/d{}'.format(name, size, size, depth),
+                'bench': 'optimality',
+                'search': name,
+                'size': size,
+                'depth': depth,
+                'positions': len(cases),
+                'optimal': optimal / len(cases),
+                'mean_loss': loss / len(cases),
+            })
+    return results
+
+
+def run_move_generation(size, config, seed):
+    boards = [(build_board(size, moves), maxTurn) for moves, maxTurn in make_positions(size, config['positions'], seed)]
+    latencies = []
+    generated = 0
+    for g, maxTurn in boards:
+        side = 'O' if maxTurn else 'X'
+        for _ in range(config['repeats'] * 20):
+            start = timeit.default_timer()
+            moves = g.get_available_moves(side)
+            latencies.append(timeit.default_timer() - start)
+            generated += len(moves)
+    seconds = sum(latencies)
+    result = {
+        'id': 'get_available_moves/{}x{}'.format(size, size),
+        'bench': 'get_available_moves',
+        'size': size,
+        'moves_per_sec': generated / seconds if seconds else 0.0,
+    }
+    result.update(latency_stats(latencies))
+    return result
+
+
+def run_make_move(size, config, seed):
+    boards = [(build_board(size, moves), maxTurn) for moves, maxTurn in make_positions(size, config['positions'], seed)]
+    latencies = []
+    for g, maxTurn in boards:
+        moves = g.get_available_moves('O' if maxTurn else 'X')
+        for _ in range(config['repeats'] * 20):
+            for move in moves:
+                start = timeit.default_timer()
+                undo = g.make_move(move[0][0], move[0][1], move[1])
+                latencies.append(timeit.default_timer() - start)
+                g.undo_move(undo)
+    seconds = sum(latencies)
+    result = {
+        'id': 'make_move/{}x{}'.format(size, size),
+        'bench': 'make_move',
+        'size': size,
+        'moves_per_sec': len(latencies) / seconds if seconds else 0.0,
+    }
+    result.update(latency_stats(latencies))
+    return result
+
+
+def run_evaluation(size, config, seed):
+    boards = [build_board(size, moves) for moves, _ in make_positions(size, config['positions'], seed)]
+    latencies = []
+    for g in boards:
+        for _ in range(config['repeats'] * 20):
+            start = timeit.default_timer()
+            evaluate(g)
+            latencies.append(timeit.default_timer() - start)
+    seconds = sum(latencies)
+
+    # the same positions repeated into one batch of about 10000 boards
+    copies = 10000 // len(boards)
+    arrays = [to_array(g) for g in boards] * copies
+    scores = [g.get_score('O') for g in boards] * copies
+    start = timeit.default_timer()
+    evaluate_batch(arrays, scores)
+    batch_seconds = timeit.default_timer() - start
+    result = {
+        'id': 'evaluate/{}x{}'.format(size, size),
+        'bench': 'evaluate',
+        'size': size,
+        'evals_per_sec': len(latencies) / seconds if seconds else 0.0,
+        'batch_evals_per_sec': len(arrays) / batch_seconds if batch_seconds else 0.0,
+    }
+    result.update(latency_stats(latencies))
+    return result
+
+
+def run_training(size, config, seed):
+    games = config['training_games']
+
+    def train():
+        random.seed(seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            q_learning_train(Game(size, size), size, size, games)
+
+    start = timeit.default_timer()
+    train()
+    seconds = timeit.default_timer() - start
+    return {
+        'id': 'q_learning_train/{}x{}'.format(size, size),
+        'bench': 'q_learning_train',
+        'size': size,
+        'games': games,
+        'games_per_sec': games / seconds if seconds else 0.0,
+        'peak_kb': peak_memory(train),
+    }
+
+
+def run_training_step(size, config, seed):
+    """
+    Time QLearningPlayer.complete_move, the step of every training game,
+    over the moves of training_games self-play games, and measure the
+    memory it allocates: the peak of the memory allocated during a step
+    above what was in use before it, averaged over the steps.
+    """
+    def games(step):
+        players = {'X': QLearningPlayer('X'), 'O': QLearningPlayer('O')}
+        rng = random.Random(seed)
+        for _ in range(config['training_games']):
+            random.seed(rng.random())
+            g = Game(size, size)
+            side = 'X'
+            while not step(players[side], g):
+                side = 'O' if side == 'X' else 'X'
+
+    steps = [0]
+
+    def timed(player, g):
+        steps[0] += 1
+        return player.complete_move(g)
+
+    start = timeit.default_timer()
+    games(timed)
+    seconds = timeit.default_timer() - start
+
+    peaks = []
+
+    def traced(player, g):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        finished = player.complete_move(g)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        return finished
+
+    tracemalloc.start()
+    try:
+        games(traced)
+    finally:
+        tracemalloc.stop()
+    return {
+        'id': 'training_step/{}x{}'.format(size, size),
+        'bench': 'training_step',
+        'size': size,
+        'steps': steps[0],
+        'steps_per_sec': steps[0] / seconds if seconds else 0.0,
+        'step_us': seconds / steps[0] * 1e6 if steps[0] else 0.0,
+        'step_peak_bytes': sum(peaks) / len(peaks) if peaks else 0.0,
+    }
+
+
+def run_symmetry(size, config, seed):
+    """
+    Count the distinct positions within symmetry_plies plies of the start
+    and the entries and memory of the Q tables trained as in run_training,
+    each without and with mirror canonicalization
+    """
+    mirror = Mirror(size, size)
+    board = BitboardGame(size, size)
+    seen = set()
+
+    def walk(side, plies):
+        seen.add((board.get_state(), side))
+        if plies == 0:
+            return
+        other = 'O' if side == 'X' else 'X'
+        for move in board.get_available_moves(side):
+            undo = board.make_move(move[0][0], move[0][1], move[1])
+            if not board.game_finish(side):
+                walk(other, plies - 1)
+            board.undo_move(undo)
+
+    walk('X', config['symmetry_plies'])
+    canonical = {(mirror.canonical(code)[0], side) for code, side in seen}
+
+    tables = []
+    for symmetry in (False, True):
+        random.seed(seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            player = q_learning_train(Game(size, size), size, size, config['training_games'], symmetry=symmetry)
+        tables.append(player.q.stats())
+    return {
+        'id': 'symmetry/{}x{}'.format(size, size),
+        'bench': 'symmetry',
+        'size': size,
+        'plies': config['symmetry_plies'],
+        'positions': len(seen),
+        'canonical_positions': len(canonical),
+        'position_reduction': 1 - len(canonical) / len(seen),
+        'q_entries': tables[0]['entries'],
+        'q_entries_mirrored': tables[1]['entries'],
+        'q_memory_bytes': tables[0]['memory_bytes'],
+        'q_memory_bytes_mirrored': tables[1]['memory_bytes'],
+        'q_entry_reduction': 1 - tables[1]['entries'] / tables[0]['entries'] if tables[0]['entries'] else 0.0,
+    }
+
+
+def run_all(config, seed, only=None, log=None):
+    """
+    :param: config, seed, only (list of benchmark names), log (file for progress)
+    :return: list of result dicts
+    """
+    results = []
+
+    def add(result):
+        results.append(result)
+        if log is not None:
+            print(result['id'], file=log)
+
+    for size in config['sizes']:
+        for name in ('minimax', 'alpha_beta', 'cuttingoff_search'):
+            if only and name not in only:
+                continue
+            for depth in config['depths'][name]:
+                add(run_search(name, size, depth, config, seed))
+        if not only or 'quality' in only:
+            for result in run_decision_quality(size, config, seed):
+                add(result)
+        if not only or 'get_available_moves' in only:
+            add(run_move_generation(size, config, seed))
+        if not only or 'make_move' in only:
+            add(run_make_move(size, config, seed))
+        if not only or 'evaluate' in only:
+            add(run_evaluation(size, config, seed))
+        if not only or 'q_learning_train' in only:
+            add(run_training(size, config, seed))
+        if not only or 'training_step' in only:
+            add(run_training_step(size, config, seed))
+        if not only or 'symmetry' in only:
+            add(run_symmetry(size, config, seed))
+    if not only or 'optimality' in only:
+        for result in run_optimality(config, seed):
+            add(result)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    :param: results, baseline (lists of result dicts), threshold (fraction)
+    :return: list of regressions
+
+    Match results to the baseline by id and report every compared metric
+    that is worse than the baseline by more than threshold.
+    """
+    base = {result['id']: result for result in baseline}
+    regressions = []
+    for result in results:
+        old = base.get(result['id'])
+        if old is None:
+            continue
+        for metric in COMPARED:
+            if metric not in result or not old.get(metric):
+                continue
+            change = (result[metric] - old[metric]) / old[metric]
+            worse = -change if metric in THROUGHPUT else change
+            if worse > threshold:
+                regressions.append({'id': result['id'], 'metric': metric, 'baseline': old[metric],
+                                    'current': result[metric], 'change': change})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', help='write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare against a stored results file')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative change counted as a regression (default 0.10)')
+    parser.add_argument('--quick', action='store_true', help='run a small matrix')
+    parser.add_argument('--sizes', type=int, nargs='+', help='board sizes to run')
+    parser.add_argument('--only', nargs='+', help='benchmarks to run')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    config = dict(QUICK if args.quick else FULL)
+    if args.sizes:
+        config['sizes'] = args.sizes
+
+    report = {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'seed': args.seed,
+                 'config': config},
+        'results': run_all(config, args.seed, args.only, sys.stderr),
+    }
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report['regressions'] = compare(report['results'], baseline['results'], args.threshold)
+        for reg in report['regressions']:
+            print('REGRESSION {id} {metric}: {baseline:.4g} -> {current:.4g} ({change:+.1%})'.format(**reg),
+                  file=sys.stderr)
+        status = 1 if report['regressions'] else 0
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+from Symmetry import paired_zobrist_keys
+
+
+class BitboardGame:
+    """
+    A bitboard implementation of the board game.
+
+    Each side is stored as an integer bitmask where bit (row * total_col + col)
+    is set when that side has a piece on (row, col). Moves are generated with
+    shift/mask operations instead of scanning the board, and the state is a
+    single integer. The public API matches Game so the search functions and
+    QLearningPlayer can run on either backend.
+    """
+    # class constructor
+    def __init__(self, row, col):
+        if row < 3 or col < 3:
+            print("board too small")
+        else:
+            self.score = 0
+            self.rewards = [0, 0]
+            self.total_row = row
+            self.total_col = col
+            self.num_cells = row * col
+
+            row_mask = (1 << col) - 1
+            left_col = sum(1 << (r * col) for r in range(row))
+            right_col = left_col << (col - 1)
+
+            # first_row is the goal row of 'X', last_row is the goal row of 'O'
+            self.first_row = row_mask
+            self.last_row = row_mask << ((row - 1) * col)
+            # pieces that can step to the left / right without leaving the board
+            self.not_left_col = ((1 << self.num_cells) - 1) & ~left_col
+            self.not_right_col = ((1 << self.num_cells) - 1) & ~right_col
+
+            self.x = self.last_row
+            self.o = self.first_row
+            self.prev_state = None
+
+            # Zobrist hash of the board and of its mirror image, updated
+            # incrementally by make_move
+            keys = paired_zobrist_keys(row, col)
+            self.hash = 0
+            for j in range(col):
+                self.hash ^= keys['O'][j] ^ keys['X'][(row - 1) * col + j]
+
+    def _bit(self, row, col):
+        return 1 << (row * self.total_col + col)
+
+    def _side_bits(self, side):
+        return self.x if side == 'X' else self.o
+
+    def can_move(self, row, col, horizontal_move, side):
+        """
+         This function will handle all possible cases
+        :param: row, col, horizontal_move,side
+        :return: True if can make a move, otherwise False
+        """
+        if row >= self.total_row or row < 0 or col >= self.total_col or col < 0:
+            return False
+        own = self._side_bits(side)
+        if not own & self._bit(row, col):
+            return False
+        if side == 'X' and row == 0:
+            return False
+        if side == 'O' and row == self.total_row - 1:
+            return False
+        if col + horizontal_move < 0 or col + horizontal_move >= self.total_col:
+            return False
+        if own & self._bit(row - (1 if side == 'X' else -1), col + horizontal_move):
+            return False
+
+        return True
+
+    def _movable(self, side):
+        """
+        Return the bitmasks of pieces that can move with horizontal moves
+        -1, 0 and 1, indexed by source square.
+        """
+        col = self.total_col
+        if side == 'X':
+            own = self.x & ~self.first_row
+            free = ~self.x
+            # a destination shifted back by (col - h) gives its source square
+            return ((own & self.not_left_col) & (free << (col + 1)),
+                    own & (free << col),
+                    (own & self.not_right_col) & (free << (col - 1)))
+        own = self.o & ~self.last_row
+        free = ~self.o
+        return ((own & self.not_left_col) & (free >> (col - 1)),
+                own & (free >> col),
+                (own & self.not_right_col) & (free >> (col + 1)))
+
+    def get_available_moves(self, side, moves=None):
+        """
+            Get next available moves givin current state.
+            side: player side
+            moves: optional list to clear and fill instead of a new one
+        """
+        left, straight, right = self._movable(side)
+        col = self.total_col
+        if moves is None:
+            moves = []
+        else:
+            del moves[:]
+        sources = left | straight | right
+        # walk the set bits in ascending order to match Game's row-major scan
+        while sources:
+            low = sources & -sources
+            idx = low.bit_length() - 1
+            piece = (idx // col, idx % col)
+            if left & low:
+                moves.append((piece, -1))
+            if straight & low:
+                moves.append((piece, 0))
+            if right & low:
+                moves.append((piece, 1))
+            sources ^= low
+
+        return moves
+
+    def is_capture(self, row, col, horizontal_move, side):
+        """
+        :param: row, col, horizontal_move, side
+        :return: True if the move lands on a piece of the other side
+        """
+        other = self.o if side == 'X' else self.x
+        return bool(other & self._bit(row - (1 if side == 'X' else -1), col + horizontal_move))
+
+    def make_move(self, row, col, horizontal_move):
+        """
+        This function will make the move and assigns utility scores accordingly
+        :param: row,col,horizontal_move
+        :return: undo record to pass to undo_move
+        """
+        undo = (self.x, self.o, self.score, self.rewards[0], self.rewards[1], self.hash, self.prev_state)
+        self.prev_state = self.get_state()
+        keys = paired_zobrist_keys(self.total_row, self.total_col)
+        src_idx = row * self.total_col + col
+        src = 1 << src_idx
+        if self.x & src:
+            dst_idx = src_idx - self.total_col + horizontal_move
+            dst = 1 << dst_idx
+            self.hash ^= keys['X'][src_idx] ^ keys['X'][dst_idx]
+            self.x ^= src
+            if self.o & dst:
+                self.hash ^= keys['O'][dst_idx]
+                self.o ^= dst
+                self.score += 1
+                self.rewards[0] += 20
+                self.rewards[1] -= 20
+            if row == 1:
+                self.score += 5
+                self.rewards[0] += 100
+                self.rewards[1] -= 100
+            self.x |= dst
+        elif self.o & src:
+            dst_idx = src_idx + self.total_col + horizontal_move
+            dst = 1 << dst_idx
+            self.hash ^= keys['O'][src_idx] ^ keys['O'][dst_idx]
+            self.o ^= src
+            if self.x & dst:
+                self.hash ^= keys['X'][dst_idx]
+                self.x ^= dst
+                self.score -= 1
+                self.rewards[0] -= 50
+                self.rewards[1] += 50
+            if row == self.total_row - 2:
+                self.score -= 5
+                self.rewards[1] += 100
+                self.rewards[0] -= 100
+            self.o |= dst
+        return undo
+
+    def undo_move(self, undo):
+        """
+        Take back a move made by make_move
+        :param: undo record returned by make_move
+        :return: None
+        """
+        self.x, self.o, self.score, reward_x, reward_o, self.hash, self.prev_state = undo
+        self.rewards[0] = reward_x
+        self.rewards[1] = reward_o
+
+    def game_finish(self, side):
+        """
+
+        :param: side
+        :return: if the game is finished(True/False)
+        """
+        if not self.x or not self.o:
+            return True
+        if side == 'X':
+            return bool(self.x & self.first_row)
+        return bool(self.o & self.last_row)
+
+    def get_score(self, side):
+        """
+
+        :param: side
+        :return: scores of each player
+        """
+        if side == 'X':
+            return self.score
+        else:
+            return -self.score
+
+    def get_reward(self):
+        return self.rewards
+
+    def get_pieces(self, side):
+        """
+           Return locations of all pieces of specified player in
+           row-major order
+        """
+        bits = self._side_bits(side)
+        col = self.total_col
+        output = []
+        while bits:
+            low = bits & -bits
+            idx = low.bit_length() - 1
+            output.append((idx // col, idx % col))
+            bits ^= low
+        return output
+
+    def get_state(self):
+        """
+        Return the board as a single integer: the 'X' bitmask in the low
+        bits and the 'O' bitmask shifted above it
+        """
+        return self.x | (self.o << self.num_cells)
+
+    def get_prev_state(self):
+        """
+        Return the previous state of the board
+        """
+        return self.prev_state
+
+    # states are already integer keys
+    get_state_key = get_state
+    get_prev_state_key = get_prev_state
+
+    @property
+    def board(self):
+        """
+        Return the board as a list of lists of 'O'/'X'/'_' like Game.board
+        """
+        output = []
+        for i in range(self.total_row):
+            row = []
+            for j in range(self.total_col):
+                bit = self._bit(i, j)
+                row.append('X' if self.x & bit else 'O' if self.o & bit else '_')
+            output.append(row)
+        return output
+
+    # print out the whole board
+    def __str__(self):
+        return ('\n'.join([str(row_idx) + ' ' +
+                ''.join(row) for row_idx, row in enumerate(self.board)]) + '\n  ' +
+                ''.join(map(str, list(range(self.total_col)))) + '\n')
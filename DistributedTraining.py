@@ -0,0 +1,158 @@
+import os
+import random
+import timeit
+from concurrent.futures import ProcessPoolExecutor
+from Game import Game, play_training_game
+from QLearner import QLearningPlayer
+from QTable import QTable
+
+# the copy of the master tables kept by a worker process between rounds
+_replica = []
+
+
+def _train_worker(row, col, deltas, params, num_games, seed):
+    """
+    Worker task: bring the copy of the master tables this process keeps up
+    to date with deltas, the merged entries of the rounds it has not seen,
+    play num_games self-play games from there and return the entries
+    visited with their visit counts, the win counts and the time taken.
+    """
+    random.seed(seed)
+    if not _replica:
+        _replica.extend([QTable(), QTable()])
+    for delta in deltas:
+        for table, entries in zip(_replica, delta):
+            for key, value in entries:
+                table.set_key(key, value, 0)
+    players = [QLearningPlayer('X', *params), QLearningPlayer('O', *params)]
+    for player, table in zip(players, _replica):
+        table.reset_visits()
+        player.q = table
+
+    g = Game(row, col)
+    win_list = [0, 0]
+    start = timeit.default_timer()
+    for _ in range(num_games):
+        game = play_training_game(g, players[0], players[1])
+        rewards = game.get_reward()
+        win_list[rewards.index(max(rewards))] += 1
+    elapsed = timeit.default_timer() - start
+
+    updates = []
+    for table in _replica:
+        updates.append([(key, table.values[slot], table.visits[slot])
+                        for key, slot in table.slots.items() if table.visits[slot]])
+    return updates, win_list, elapsed
+
+
+def merge_updates(master, updates):
+    """
+    :param: master QTable, list of [(key, value, visits), ...] per worker
+    :return: list of the (key, value) entries set
+
+    Set every entry visited by a worker to the average of the worker values
+    weighted by their visit counts. Entries no worker visited keep the
+    master value.
+    """
+    totals = {}
+    for entries in updates:
+        for key, value, visits in entries:
+            total = totals.get(key)
+            if total is None:
+                totals[key] = [value * visits, visits]
+            else:
+                total[0] += value * visits
+                total[1] += visits
+    merged = []
+    for key, (weighted, visits) in totals.items():
+        master.set_key(key, weighted / visits, visits)
+        merged.append((key, weighted / visits))
+    return merged
+
+
+def distributed_q_learning_train(row, col, num_training_iter, workers=None, sync_every=200, seed=0,
+                                 epsilon=0.1, alpha=0.3, gamma=0.9, verbose=True):
+    """
+    :param: row, col, num_training_iter, workers, sync_every, seed, epsilon, alpha, gamma, verbose
+    :return: the player with more wins, list of per-round stats
+
+    Train a pair of QLearningPlayers with self-play on several processes.
+    Each round every worker plays sync_every games with its own random seed
+    starting from the master Q-tables. The visited entries are then merged
+    into the master tables by visit-count weighted averaging, and the next
+    round starts from the merged tables.
+
+    Every worker is a process of its own that keeps a copy of the master
+    tables between rounds. A round only sends it the entries merged since
+    the last round it played, so the cost of a round grows with the entries
+    the workers change rather than with the size of the tables. The stats
+    of every round hold the games per second of each worker and the number
+    of entries sent.
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    params = (epsilon, alpha, gamma)
+    masters = [QTable(), QTable()]
+    win_list = [0, 0]
+    stats = []
+    # the merged entries of the rounds not yet sent to every worker, and how
+    # many of them each worker has
+    deltas = []
+    sent = [0] * workers
+
+    if verbose:
+        print("Training {} iterations on {} workers...".format(num_training_iter, workers))
+    # one single-process pool per worker, so each task finds its own copy
+    executors = [ProcessPoolExecutor(1) for _ in range(workers)]
+    try:
+        done = 0
+        round_idx = 0
+        while done < num_training_iter:
+            remaining = num_training_iter - done
+            games = [min(sync_every, max(0, remaining - k * sync_every)) for k in range(workers)]
+            futures = []
+            sync_entries = 0
+            for k in range(workers):
+                if not games[k]:
+                    continue
+                pending = deltas[sent[k]:]
+                sync_entries += sum(len(entries) for delta in pending for entries in delta)
+                futures.append(executors[k].submit(_train_worker, row, col, pending, params, games[k],
+                                                   seed * 1000003 + round_idx * workers + k))
+                sent[k] = len(deltas)
+            results = [future.result() for future in futures]
+
+            start = timeit.default_timer()
+            deltas.append([merge_updates(masters[side], [result[0][side] for result in results])
+                           for side in range(2)])
+            merge_time = timeit.default_timer() - start
+            # forget the rounds every worker has
+            seen = min(sent)
+            del deltas[:seen]
+            sent = [count - seen for count in sent]
+
+            round_stats = {'round': round_idx, 'games': sum(games), 'merge_seconds': merge_time,
+                           'sync_entries': sync_entries, 'entries': [len(masters[0]), len(masters[1])],
+                           'workers': []}
+            for k, (_, wins, elapsed) in enumerate(results):
+                win_list[0] += wins[0]
+                win_list[1] += wins[1]
+                round_stats['workers'].append({'worker': k, 'games': games[k], 'seconds': elapsed,
+                                               'games_per_sec': games[k] / elapsed if elapsed else 0.0})
+            stats.append(round_stats)
+
+            done += sum(games)
+            round_idx += 1
+            if verbose:
+                rates = ', '.join('{:.1f}'.format(w['games_per_sec']) for w in round_stats['workers'])
+                print("{}/{} done. games/sec per worker: {}".format(done, num_training_iter, rates))
+    finally:
+        for executor in executors:
+            executor.shutdown()
+
+    players = [QLearningPlayer('X', *params), QLearningPlayer('O', *params)]
+    for player, table in zip(players, masters):
+        player.q = table
+    if win_list.index(max(win_list)) == 0:
+        return players[0], stats
+    return players[1], stats
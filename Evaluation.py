@@ -0,0 +1,244 @@
+"""
+Static evaluation of positions for the cut-off search.
+
+A position is described by features computed from the bitboards of both
+sides, each one 'O' minus 'X':
+
+    material     pieces on the board
+    advancement  rows each piece has advanced from its starting row
+    passed       pieces no enemy piece can stop: none ahead in the same or
+                 a neighbouring column
+    threatened   enemy pieces that can be captured next move
+    mobility     legal moves
+
+The value of a position is its get_score('O') plus the weighted sum of the
+features, so it is on the same scale as the leaf values of alpha_beta.
+features_batch and evaluate_batch compute the same numbers for many boards
+at once with NumPy, from arrays shaped like BatchGame.boards.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from QTable import encode_state
+
+FEATURES = ('material', 'advancement', 'passed', 'threatened', 'mobility')
+DEFAULT_WEIGHTS = (0.5, 0.1, 1.0, 0.3, 0.05)
+
+_masks = {}
+_planes = {}
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+if hasattr(int, 'bit_count'):
+    # Python 3.10+
+    _popcount = int.bit_count
+
+
+def board_masks(rows, cols):
+    """
+    Return (full, row_mask, not_left_col, not_right_col) bitmasks of a board
+    """
+    masks = _masks.get((rows, cols))
+    if masks is None:
+        full = (1 << (rows * cols)) - 1
+        left_col = sum(1 << (r * cols) for r in range(rows))
+        masks = _masks[(rows, cols)] = (full, (1 << cols) - 1, full & ~left_col,
+                                        full & ~(left_col << (cols - 1)))
+    return masks
+
+
+def row_planes(rows, cols):
+    """
+    Return the bitmasks of the rows of a board whose row number has bit k
+    set, for k = 0, 1, ...
+    """
+    planes = _planes.get((rows, cols))
+    if planes is None:
+        row_mask = (1 << cols) - 1
+        planes = []
+        while (1 << len(planes)) < rows:
+            bit = 1 << len(planes)
+            planes.append(sum(row_mask << (r * cols) for r in range(rows) if r & bit))
+        planes = _planes[(rows, cols)] = tuple(planes)
+    return planes
+
+
+def bitboards(board):
+    """
+    Return the 'X' and 'O' bitmasks of a Game or BitboardGame
+    """
+    if hasattr(board, 'x'):
+        return board.x, board.o
+    num_cells = board.total_row * board.total_col
+    if hasattr(board, 'state_key'):
+        code = board.state_key
+    else:
+        code = encode_state(board.get_state())
+    return code & ((1 << num_cells) - 1), code >> num_cells
+
+
+def features(board):
+    """
+    :param: board (Game or BitboardGame)
+    :return: tuple of the FEATURES of board, 'O' minus 'X'
+    """
+    x, o = bitboards(board)
+    return features_from_bits(x, o, board.total_row, board.total_col)
+
+
+def features_from_bits(x, o, rows, cols):
+    """
+    Same as features for the bitmasks of a rows x cols board
+    """
+    full, row_mask, not_left, not_right = board_masks(rows, cols)
+
+    # squares each side attacks: 'X' moves up a row, 'O' down a row, and a
+    # move straight ahead captures too
+    x_up = x >> cols
+    x_left = (x & not_left) >> (cols + 1)
+    x_right = (x & not_right) >> (cols - 1)
+    o_down = full & (o << cols)
+    o_left = full & ((o & not_left) << (cols - 1))
+    o_right = full & ((o & not_right) << (cols + 1))
+    x_attacks = x_up | x_left | x_right
+    o_attacks = o_down | o_left | o_right
+
+    x_moves = _popcount(x_up & ~x) + _popcount(x_left & ~x) + _popcount(x_right & ~x)
+    o_moves = _popcount(o_down & ~o) + _popcount(o_left & ~o) + _popcount(o_right & ~o)
+
+    # sum of the row numbers bit by bit: plane k holds the rows with bit k set
+    advancement = -(rows - 1) * _popcount(x)
+    for k, plane in enumerate(row_planes(rows, cols)):
+        advancement += (_popcount(o & plane) + _popcount(x & plane)) << k
+
+    # a piece is passed when no enemy piece is ahead of it in its own or a
+    # neighbouring column: fill the squares behind each enemy piece, then
+    # widen them by a column on both sides
+    x_ahead = x_up
+    o_ahead = o_down
+    shift = cols
+    while shift < rows * cols:
+        x_ahead |= x_ahead >> shift
+        o_ahead |= full & (o_ahead << shift)
+        shift <<= 1
+    x_span = x_ahead | ((x_ahead & not_left) >> 1) | ((x_ahead & not_right) << 1)
+    o_span = o_ahead | ((o_ahead & not_left) >> 1) | ((o_ahead & not_right) << 1)
+    passed = _popcount(o & ~x_span) - _popcount(x & ~o_span)
+
+    return (_popcount(o) - _popcount(x), advancement, passed,
+            _popcount(x & o_attacks) - _popcount(o & x_attacks), o_moves - x_moves)
+
+
+def evaluate(board, weights=DEFAULT_WEIGHTS):
+    """
+    :param: board, weights (one per feature)
+    :return: value of board for 'O'
+    """
+    value = board.get_score('O')
+    for weight, feature in zip(weights, features(board)):
+        value += weight * feature
+    return value
+
+
+def features_batch(boards):
+    """
+    :param: boards, array (N, rows, cols) with 1 for 'X', -1 for 'O', 0 empty
+    :return: array (N, len(FEATURES)) of the features of every board
+    """
+    if np is None:
+        raise ImportError("features_batch needs NumPy")
+    boards = np.asarray(boards)
+    n, rows, cols = boards.shape
+    x = boards == 1
+    o = boards == -1
+
+    x_attacks = np.zeros_like(x)
+    x_attacks[:, :-1, :] |= x[:, 1:, :]
+    x_attacks[:, :-1, :-1] |= x[:, 1:, 1:]
+    x_attacks[:, :-1, 1:] |= x[:, 1:, :-1]
+    o_attacks = np.zeros_like(o)
+    o_attacks[:, 1:, :] |= o[:, :-1, :]
+    o_attacks[:, 1:, :-1] |= o[:, :-1, 1:]
+    o_attacks[:, 1:, 1:] |= o[:, :-1, :-1]
+
+    x_moves = ((x[:, 1:, :] & ~x[:, :-1, :]).sum(axis=(1, 2)) + (x[:, 1:, 1:] & ~x[:, :-1, :-1]).sum(axis=(1, 2))
+               + (x[:, 1:, :-1] & ~x[:, :-1, 1:]).sum(axis=(1, 2)))
+    o_moves = ((o[:, :-1, :] & ~o[:, 1:, :]).sum(axis=(1, 2)) + (o[:, :-1, 1:] & ~o[:, 1:, :-1]).sum(axis=(1, 2))
+               + (o[:, :-1, :-1] & ~o[:, 1:, 1:]).sum(axis=(1, 2)))
+
+    row_idx = np.arange(rows).reshape(1, rows, 1)
+    advancement = (o * row_idx).sum(axis=(1, 2)) - (x * (rows - 1 - row_idx)).sum(axis=(1, 2))
+
+    # enemy pieces strictly ahead: below each row for 'O', above it for 'X'
+    x_below = np.zeros_like(x)
+    x_below[:, :-1] = np.logical_or.accumulate(x[:, ::-1], axis=1)[:, ::-1][:, 1:]
+    o_above = np.zeros_like(o)
+    o_above[:, 1:] = np.logical_or.accumulate(o, axis=1)[:, :-1]
+    passed = ((o & ~_widen(x_below)).sum(axis=(1, 2)) - (x & ~_widen(o_above)).sum(axis=(1, 2)))
+
+    return np.stack([o.sum(axis=(1, 2)) - x.sum(axis=(1, 2)), advancement, passed,
+                     (x & o_attacks).sum(axis=(1, 2)) - (o & x_attacks).sum(axis=(1, 2)),
+                     o_moves - x_moves], axis=1)
+
+
+def _widen(span):
+    """
+    Return span with every square also covering its left and right neighbours
+    """
+    wide = span.copy()
+    wide[:, :, 1:] |= span[:, :, :-1]
+    wide[:, :, :-1] |= span[:, :, 1:]
+    return wide
+
+
+def evaluate_batch(boards, scores, weights=DEFAULT_WEIGHTS):
+    """
+    :param: boards (N, rows, cols), scores (N,) of get_score('O'), weights
+    :return: array (N,) of the values of the boards for 'O'
+    """
+    return np.asarray(scores, dtype=np.float64) + features_batch(boards) @ np.asarray(weights, dtype=np.float64)
+
+
+def to_array(board):
+    """
+    Return a Game or BitboardGame as a (rows, cols) array for features_batch
+    """
+    x, o = bitboards(board)
+    cells = board.total_row * board.total_col
+    x_bits = np.array([(x >> i) & 1 for i in range(cells)], dtype=np.int8)
+    o_bits = np.array([(o >> i) & 1 for i in range(cells)], dtype=np.int8)
+    return (x_bits - o_bits).reshape(board.total_row, board.total_col)
+
+
+def evaluate_children(board, side, weights=DEFAULT_WEIGHTS):
+    """
+    :param: board, side to move, weights
+    :return: list of moves of side, array of the values of the positions they lead to
+
+    Score every child of board in one evaluate_batch call, as a frontier
+    node of a search would. The child boards are built from one array copy
+    per move instead of making and evaluating each move in turn.
+    """
+    moves = board.get_available_moves(side)
+    if not moves:
+        return moves, np.zeros(0)
+    base = to_array(board)
+    boards = np.repeat(base[np.newaxis], len(moves), axis=0)
+    scores = np.full(len(moves), board.get_score('O'), dtype=np.float64)
+    value = 1 if side == 'X' else -1
+    goal = 0 if side == 'X' else board.total_row - 1
+    for i, ((row, col), h_move) in enumerate(moves):
+        dst_row = row - value
+        dst_col = col + h_move
+        # captures and promotions of 'X' lower the score of 'O'
+        if boards[i, dst_row, dst_col] == -value:
+            scores[i] -= value
+        if dst_row == goal:
+            scores[i] -= 5 * value
+        boards[i, row, col] = 0
+        boards[i, dst_row, dst_col] = value
+    return moves, evaluate_batch(boards, scores, weights)
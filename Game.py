@@ -1,8 +1,26 @@
 import copy
+import os
 import timeit
-from QLearner import QLearningPlayer
+from QLearner import QLearningPlayer, load_player, save_checkpoint, load_checkpoint
+from QTable import encode_state
+from TranspositionTable import TranspositionTable, EXACT, LOWER, UPPER
+from Symmetry import Mirror, mirror_action, paired_zobrist_keys, tt_key
+from MoveOrdering import MoveOrderer
+from SearchStats import SearchStats
+from Tablebase import Tablebase
+from MCTS import MCTS
+from Evaluation import evaluate, DEFAULT_WEIGHTS
 import random
 
+# squares whose cached moves a move can change, by (row, col, dst_row, dst_col)
+_affected = {}
+
+
+class SearchTimeout(Exception):
+    """Raised inside a search when its deadline has passed"""
+    pass
+
+
 class Game:
     """
     This class provides all features for this board game.
@@ -19,9 +37,32 @@ class Game:
             self.total_col = col
             self.moves = []
             self.init_state = [['O' for _ in range(col)]] + [['_' for _ in range(col)] for _ in range(row - 2)] + [['X' for _ in range(col)]]
-            self.prev_state = None
+            self.last_move = None
             self.board = [['O' for _ in range(col)]] + [['_' for _ in range(col)] for _ in range(row - 2)] + [['X' for _ in range(col)]]
 
+            # squares of the pieces of each side and how many of them stand on
+            # the row they are heading for, updated incrementally by make_move
+            self.pieces = {'O': {(0, j) for j in range(col)}, 'X': {(row - 1, j) for j in range(col)}}
+            self.arrived = {'O': 0, 'X': 0}
+
+            # legal moves of the piece on a square, dropped when a move changes
+            # the square or the squares in front of it. Moves made and taken
+            # back are collected in dirty and invalidated on the next lookup
+            self.move_cache = {}
+            self.dirty = set()
+
+            # Zobrist hash of the board and of its mirror image, updated
+            # incrementally by make_move
+            keys = paired_zobrist_keys(row, col)
+            self.hash = 0
+            for j in range(col):
+                self.hash ^= keys['O'][j] ^ keys['X'][(row - 1) * col + j]
+
+            # encode_state of the board, updated incrementally by make_move:
+            # the 'X' bitmask in the low row * col bits and 'O' above it
+            self.num_cells = row * col
+            self.state_key = (((1 << col) - 1) << ((row - 1) * col)) | (((1 << col) - 1) << self.num_cells)
+
 
     def can_move(self, row, col, horizontal_move, side):
         """
@@ -43,34 +84,115 @@ class Game:
             return False
 
         return True
-    
-    def get_available_moves(self, side):
+
+    def __deepcopy__(self, memo):
+        """
+        Copy the game for a search or a training game. The Zobrist keys are
+        shared by all games of a board size and are not copied, and the copy
+        starts with an empty move cache that it refills as it needs it.
+        """
+        new = Game.__new__(Game)
+        memo[id(self)] = new
+        new.__dict__.update(self.__dict__)
+        if hasattr(self, 'board'):
+            new.rewards = list(self.rewards)
+            new.moves = copy.deepcopy(self.moves, memo)
+            new.init_state = [row[:] for row in self.init_state]
+            new.board = [row[:] for row in self.board]
+            new.pieces = {side: set(squares) for side, squares in self.pieces.items()}
+            new.arrived = dict(self.arrived)
+            new.move_cache = {}
+            new.dirty = set()
+        return new
+
+    def get_available_moves(self, side, moves=None):
         """
             Get next available moves givin current state.
             side: player side
+            moves: optional list to clear and fill instead of a new one
         """
-        moves = []
+        if self.dirty:
+            self._invalidate()
+        if moves is None:
+            moves = []
+        else:
+            del moves[:]
+        cache = self.move_cache
         for piece in self.get_pieces(side):
-            for h_move in range(-1, 2):
-                if not self.can_move(piece[0], piece[1], h_move, side):
-                    continue
-                # self.board[piece[0]][piece[1]] == 'X':
-                moves.append(((piece[0], piece[1]), h_move))
-                # else:
-                    # moves.append((piece[0], piece[1] + h_move, 'O'))
-                    
+            piece_moves = cache.get(piece)
+            if piece_moves is None:
+                piece_moves = cache[piece] = [(piece, h_move) for h_move in range(-1, 2)
+                                              if self.can_move(piece[0], piece[1], h_move, side)]
+            moves.extend(piece_moves)
+
         return moves
 
+    def _invalidate(self):
+        """
+        Drop the cached moves of the pieces the moves made or taken back
+        since the last call can affect: the pieces on their squares, the 'X'
+        pieces below them and the 'O' pieces above them
+        """
+        cache = self.move_cache
+        if len(self.dirty) * 4 > len(cache):
+            # cheaper to regenerate everything than to look at every move
+            cache.clear()
+        elif cache:
+            pop = cache.pop
+            for move in self.dirty:
+                squares = _affected.get(move)
+                if squares is None:
+                    squares = set()
+                    for r, c in (move[:2], move[2:]):
+                        squares.add((r, c))
+                        for dc in range(-1, 2):
+                            squares.add((r + 1, c + dc))
+                            squares.add((r - 1, c + dc))
+                    squares = _affected[move] = tuple(squares)
+                for square in squares:
+                    pop(square, None)
+        self.dirty.clear()
+
+    def is_capture(self, row, col, horizontal_move, side):
+        """
+        :param: row, col, horizontal_move, side
+        :return: True if the move lands on a piece of the other side
+        """
+        target = self.board[row - (1 if side == 'X' else -1)][col + horizontal_move]
+        return target != side and target != '_'
+
     def make_move(self, row, col, horizontal_move):
         """
         This function will make the move and assigns utility scores accordingly
         :param: row,col,horizontal_move
-        :return: None
+        :return: undo record to pass to undo_move
         """
-        self.prev_state = copy.deepcopy(self.board)
-        if self.board[row][col] == 'X':
-            self.board[row][col] = '_'
-            if self.board[row - 1][col + horizontal_move] == 'O':
+        board = self.board
+        side = board[row][col]
+        dst_row = row - 1 if side == 'X' else row + 1
+        dst_col = col + horizontal_move
+        target = board[dst_row][dst_col]
+        undo = (row, col, dst_row, dst_col, target,
+                self.score, self.rewards[0], self.rewards[1], self.hash, self.last_move, self.state_key)
+        if side == 'X' or side == 'O':
+            keys = paired_zobrist_keys(self.total_row, self.total_col)
+            src = row * self.total_col + col
+            dst = dst_row * self.total_col + dst_col
+            self.hash ^= keys[side][src] ^ keys[side][dst]
+            shift = 0 if side == 'X' else self.num_cells
+            self.state_key ^= (1 << (src + shift)) | (1 << (dst + shift))
+            pieces = self.pieces[side]
+            pieces.remove((row, col))
+            pieces.add((dst_row, dst_col))
+            if target != side and target != '_':
+                self.hash ^= keys[target][dst]
+                self.state_key ^= 1 << (dst + self.num_cells - shift)
+                self.pieces[target].remove((dst_row, dst_col))
+            self.dirty.add((row, col, dst_row, dst_col))
+            board[row][col] = '_'
+            board[dst_row][dst_col] = side
+        if side == 'X':
+            if target == 'O':
                 self.score += 1
                 self.rewards[0] += 20
                 self.rewards[1] -= 20
@@ -78,10 +200,9 @@ class Game:
                 self.score += 5
                 self.rewards[0] += 100
                 self.rewards[1] -= 100
-            self.board[row - 1][col + horizontal_move] = 'X'
-        elif self.board[row][col] == 'O':
-            self.board[row][col] = '_'
-            if self.board[row + 1][col + horizontal_move] == 'X':
+                self.arrived['X'] += 1
+        elif side == 'O':
+            if target == 'X':
                 self.score -= 1
                 self.rewards[0] -= 50
                 self.rewards[1] += 50
@@ -89,8 +210,34 @@ class Game:
                 self.score -= 5
                 self.rewards[1] += 100
                 self.rewards[0] -= 100
-            self.board[row + 1][col + horizontal_move] = 'O'
+                self.arrived['O'] += 1
+        self.last_move = undo
+        return undo
 
+    def undo_move(self, undo):
+        """
+        Take back a move made by make_move
+        :param: undo record returned by make_move
+        :return: None
+        """
+        row, col, dst_row, dst_col, captured, score, reward_x, reward_o, self.hash, last_move, self.state_key = undo
+        board = self.board
+        side = board[dst_row][dst_col]
+        if side == 'X' or side == 'O':
+            pieces = self.pieces[side]
+            pieces.remove((dst_row, dst_col))
+            pieces.add((row, col))
+            if captured != '_':
+                self.pieces[captured].add((dst_row, dst_col))
+            if dst_row == (0 if side == 'X' else self.total_row - 1):
+                self.arrived[side] -= 1
+            self.dirty.add((row, col, dst_row, dst_col))
+        board[row][col] = side
+        board[dst_row][dst_col] = captured
+        self.score = score
+        self.rewards[0] = reward_x
+        self.rewards[1] = reward_o
+        self.last_move = last_move
 
     def game_finish(self, side):
         """
@@ -98,15 +245,9 @@ class Game:
         :param: side
         :return: if the game is finished(True/False)
         """
-        if len(self.get_pieces('X')) == 0:
-            return True
-        if len(self.get_pieces('O')) == 0:
+        if not self.pieces['X'] or not self.pieces['O']:
             return True
-        for piece in self.get_pieces(side):
-            if piece[0] == (0 if side == 'X' else self.total_row - 1):
-                return True
-
-        return False
+        return self.arrived[side] > 0
 
     def get_score(self, side):
         """
@@ -124,27 +265,46 @@ class Game:
 
     def get_pieces(self, side):
         """
-           This function loops through the board and return locations of
-           all piece of specified player
+           This function returns locations of all piece of specified player
+           in row-major order
         """
-        output = []
-        for i in range(self.total_row):
-            for j in range(self.total_col):
-                if self.board[i][j] == side:
-                    output.append((i, j))
-        return output
+        return sorted(self.pieces[side])
     
     def get_state(self):
         """
         Return the 2d list numerical representation of the board
         """
         return tuple(tuple(x) for x in self.board)
+
+    def get_state_key(self):
+        """
+        Return encode_state(get_state()) without building the state
+        """
+        return self.state_key
+
+    def get_prev_state_key(self):
+        """
+        Return the key of the previous state, saved by the last move
+        """
+        if self.last_move is None:
+            return None
+        return self.last_move[10]
     
     def get_prev_state(self):
         """
-        Return the previous state of the board
+        Return the previous state of the board, rebuilt from the last move
         """
-        return tuple(tuple(x) for x in self.prev_state)
+        if self.last_move is None:
+            return None
+        row, col, dst_row, dst_col, captured = self.last_move[:5]
+        state = [tuple(x) for x in self.board]
+        src = list(self.board[row])
+        src[col] = self.board[dst_row][dst_col]
+        state[row] = tuple(src)
+        dst = list(self.board[dst_row])
+        dst[dst_col] = captured
+        state[dst_row] = tuple(dst)
+        return tuple(state)
 
     # print out the whole board
     def __str__(self):
@@ -153,149 +313,364 @@ class Game:
                 ''.join(map(str, list(range(self.total_col)))) + '\n')
 
 
-def minimax(board, currDepth, maxTurn):
+def minimax(board, currDepth, maxTurn, stats=None, ply=0, tablebase=None, deadline=None):
     """
-    :param: board,currDepth,maxTurn
+    :param: board,currDepth,maxTurn,stats,ply,tablebase,deadline
     :return: best_move, best_score
 
     This function will traverse all node in the search tree which has all possible cases.
     It will then choose and return the best move with best utility score. The running time of this
     function will be higher than that of alpha-beta pruning which is higher than cutting-off search.
+    A SearchStats passed as stats collects node counts and timings. Positions below the root
+    found in a Tablebase get their exact value without searching them. If a deadline (in
+    timeit.default_timer() seconds) passes, SearchTimeout is raised.
     """
     best_move = ((0, 0), 0)
     best_score = 0
 
+    if stats is not None:
+        stats.node(ply)
+
+    if tablebase is not None and ply > 0:
+        value = tablebase.probe(board, maxTurn)
+        if value is not None:
+            if stats is not None:
+                stats.leaf(ply)
+            return best_move, board.get_score('O') + value
+
     # base case
     if currDepth == 0:
+        if stats is not None:
+            stats.leaf(ply)
         return best_move, board.get_score('O')
 
+    if deadline is not None and timeit.default_timer() > deadline:
+        raise SearchTimeout()
+
     # do action -- move forward by one step
-    for piece in board.get_pieces('O' if maxTurn else 'X'):
-        for h_move in range(-1, 2):
-            if board.can_move(piece[0], piece[1], h_move, 'O' if maxTurn else 'X'):
-                copy_board = copy.deepcopy(board)
-                copy_board.make_move(piece[0], piece[1], h_move)
-
-                score = minimax(copy_board, currDepth - 1, not maxTurn)[1]
-
-                if maxTurn:
-                    if score >= best_score:
-                        best_score = score
-                        best_move = (piece, h_move)
-                else:
-                    if score <= best_score:
-                        best_score = score
-                        best_move = (piece, h_move)
+    for move in board.get_available_moves('O' if maxTurn else 'X'):
+        piece, h_move = move
+        undo = board.make_move(piece[0], piece[1], h_move)
+        try:
+            if stats is not None:
+                start = stats.enter()
+            score = minimax(board, currDepth - 1, not maxTurn, stats, ply + 1, tablebase, deadline)[1]
+            if stats is not None:
+                stats.leave(ply + 1, start, move)
+        finally:
+            board.undo_move(undo)
+
+        if maxTurn:
+            if score >= best_score:
+                best_score = score
+                best_move = move
+        else:
+            if score <= best_score:
+                best_score = score
+                best_move = move
 
     return best_move, best_score
 
 
-def alpha_beta(board, currDepth, maxTurn, alpha, beta):
+def alpha_beta(board, currDepth, maxTurn, alpha, beta, tt=None, deadline=None, orderer=None, ply=0,
+               stats=None, tablebase=None):
 
     """
-    :param: board, currDepth, maxTurn, alpha, beta
+    :param: board, currDepth, maxTurn, alpha, beta, tt, deadline, orderer, ply, stats, tablebase
     :return: best_move, value
 
     This function will update alpha and beta levels and prune when beta <= alpha.
     The base case here is to return the best utility score and this is also recursively
-    done for each level
+    done for each level. If a TranspositionTable tt is given, positions already searched
+    deep enough are answered from the table and the stored best move is tried first.
+    If a deadline (in timeit.default_timer() seconds) passes, SearchTimeout is raised.
+    A MoveOrderer decides the order in which the moves of each node are searched.
+    A SearchStats passed as stats collects node counts, cutoffs and timings. Positions below
+    the root found in a Tablebase get their exact value without searching them.
     """
 
     best_move = ((0, 0), 0)
 
+    if stats is not None:
+        stats.node(ply)
+
+    if tablebase is not None and ply > 0:
+        value = tablebase.probe(board, maxTurn)
+        if value is not None:
+            if stats is not None:
+                stats.leaf(ply)
+            return best_move, board.get_score('O') + value
+
     # base case
     if currDepth == 0:
+        if stats is not None:
+            stats.leaf(ply)
         return best_move, board.get_score('O')
 
+    if deadline is not None and timeit.default_timer() > deadline:
+        raise SearchTimeout()
+
+    side = 'O' if maxTurn else 'X'
+    moves = board.get_available_moves(side)
+
+    tt_move = None
+    if tt is not None:
+        key, mirrored = tt_key(board, maxTurn)
+        alpha_orig, beta_orig = alpha, beta
+        entry = tt.probe(key, board.get_score('O'))
+        if entry is not None:
+            depth, value, bound, tt_move = entry
+            if mirrored and tt_move is not None:
+                tt_move = mirror_action(tt_move, board.total_col)
+            if depth >= currDepth:
+                if bound == EXACT:
+                    return tt_move or best_move, value
+                if bound == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if beta <= alpha:
+                    return tt_move or best_move, value
+
+    if orderer is not None:
+        moves = orderer.order(board, moves, side, ply, tt_move)
+    elif tt_move in moves:
+        moves.remove(tt_move)
+        moves.insert(0, tt_move)
+
     if maxTurn:
         value = -1000
     else:
         value = 1000
-    # do action -- move forward by one step
-    for piece in board.get_pieces('O' if maxTurn else 'X'):
-        # best_score = beta if maxTurn else alpha
-        for h_move in range(-1, 2):
-            if board.can_move(piece[0], piece[1], h_move, 'O' if maxTurn else 'X'):
-                copy_board = copy.deepcopy(board)
-                copy_board.make_move(piece[0], piece[1], h_move)
-
-                score = alpha_beta(copy_board, currDepth - 1, not maxTurn, alpha, beta)[1]
-
-                if maxTurn:
-                    if score >= value:
-                        value = score
-                        best_move = (piece, h_move)
-                        alpha = max(value, alpha)
-                        if beta <= alpha:
-                            break
-                else:
-                    if score <= value:
-                        value = score
-                        best_move = (piece, h_move)
-                        beta = min(value, beta)
-                        if beta <= alpha:
-                            break
+    # do action -- move forward by one step. A move that fails low can return
+    # the same bound as the best move so far, so only a strictly better score
+    # replaces the best move
+    for index, move in enumerate(moves):
+        piece, h_move = move
+        undo = board.make_move(piece[0], piece[1], h_move)
+        try:
+            if stats is not None:
+                start = stats.enter()
+            score = alpha_beta(board, currDepth - 1, not maxTurn, alpha, beta, tt, deadline, orderer, ply + 1,
+                               stats, tablebase)[1]
+            if stats is not None:
+                stats.leave(ply + 1, start, move)
+        finally:
+            board.undo_move(undo)
+
+        if maxTurn:
+            if score > value or index == 0:
+                value = score
+                best_move = move
+                alpha = max(value, alpha)
+                if beta <= alpha:
+                    if orderer is not None:
+                        orderer.record_cutoff(board, move, side, ply, currDepth)
+                    if stats is not None:
+                        stats.cutoff(ply, index)
+                    break
+        else:
+            if score < value or index == 0:
+                value = score
+                best_move = move
+                beta = min(value, beta)
+                if beta <= alpha:
+                    if orderer is not None:
+                        orderer.record_cutoff(board, move, side, ply, currDepth)
+                    if stats is not None:
+                        stats.cutoff(ply, index)
+                    break
+
+    if tt is not None:
+        store_result(tt, key, board, currDepth, value, alpha_orig, beta_orig, best_move if moves else None, mirrored)
 
     return best_move, value
 
 
+def store_result(tt, key, board, depth, value, alpha, beta, best_move, mirrored=False):
+    """
+    :param: tt, key, board, depth, value, alpha, beta, best_move, mirrored
+    :return: None
+
+    Save a search result in the transposition table with the bound type
+    given by the original alpha-beta window of the node. The best move of a
+    mirrored key is stored mirrored.
+    """
+    if mirrored and best_move is not None:
+        best_move = mirror_action(best_move, board.total_col)
+    if value <= alpha:
+        bound = UPPER
+    elif value >= beta:
+        bound = LOWER
+    else:
+        bound = EXACT
+    tt.store(key, depth, value, bound, best_move, board.get_score('O'))
+
+
 
 def cutoff_test(depth):
     """
 
     :param depth:
-    :return: depth
+    :return: True when the search should stop and evaluate
 
-    This cutoff test will cut off at certain level as for common cases
+    This cutoff test cuts off once the remaining depth of the search is used up
     """
-    return depth <= 2
+    return depth <= 0
 
 
-def eval(board, maxTurn):
+def eval(board, maxTurn, weights=DEFAULT_WEIGHTS):
     """
 
-    :param: board,maxTurn
-    :return: probablity of winning
+    :param: board,maxTurn,weights
+    :return: value of the position for 'O'
 
-     Evaluation function of Cuttingoff. This function calculates
-     probablity of winning for each player
+     Evaluation function of Cuttingoff. The score of the board plus the weighted
+     material, advancement, passed, threatened and mobility features of both sides
+     (see Evaluation.py), so it compares with the leaf values of alpha-beta.
     """
-    temp_locX = board.total_row
-    temp_locO = 0
+    return evaluate(board, weights)
+
 
-    # Different evaluation function for different piece
-    if not maxTurn:
-        location = board.get_pieces('X')
-        piece_onboard = len(location)
-        for i in location:
-            if location[i][0] < temp_locX:
-                temp_locX = location[i][0]
-        return temp_locX * 0.4 + piece_onboard * 0.6
+def split_noisy(board, moves, side):
+    """
+    :param: board, moves, side
+    :return: noisy moves (promotions, then captures), quiet moves
+
+    The noisy moves are the ones that reach the last row or capture, the
+    moves make_move rewards, with the larger reward first.
+    """
+    last_row = 1 if side == 'X' else board.total_row - 2
+    promotions = []
+    captures = []
+    quiet = []
+    for move in moves:
+        (row, col), h_move = move
+        if row == last_row:
+            promotions.append(move)
+        elif board.is_capture(row, col, h_move, side):
+            captures.append(move)
+        else:
+            quiet.append(move)
+    return promotions + captures, quiet
+
+
+def quiescence_search(board, maxTurn, alpha, beta, depth, weights=DEFAULT_WEIGHTS, stats=None, ply=0,
+                      deadline=None):
+    """
+
+    :param: board, maxTurn, alpha, beta, depth, weights, stats, ply, deadline
+    :return: value
+
+    Evaluate board only once it is quiet. The side to move may stand on the evaluation
+    or try its captures and promotions, which are searched up to depth more plies, so
+    a leaf is not evaluated in the middle of an exchange. SearchTimeout is raised once
+    the deadline has passed, as in the main search.
+    """
+    if stats is not None:
+        stats.node(ply)
+    value = eval(board, maxTurn, weights)
+    if depth <= 0:
+        if stats is not None:
+            stats.leaf(ply)
+        return value
+    if maxTurn:
+        if value >= beta:
+            return value
+        alpha = max(alpha, value)
     else:
-        location = board.get_pieces('O')
-        piece_onboard = len(location)
-        for i in location:
-            if location[i][0] > temp_locO:
-                temp_locO = location[i][0]
-        return temp_locO * 0.6 + piece_onboard * 0.4
+        if value <= alpha:
+            return value
+        beta = min(beta, value)
+
+    if deadline is not None and timeit.default_timer() > deadline:
+        raise SearchTimeout()
+
+    side = 'O' if maxTurn else 'X'
+    for piece, h_move in split_noisy(board, board.get_available_moves(side), side)[0]:
+        undo = board.make_move(piece[0], piece[1], h_move)
+        try:
+            score = quiescence_search(board, not maxTurn, alpha, beta, depth - 1, weights, stats, ply + 1,
+                                      deadline)
+        finally:
+            board.undo_move(undo)
+        if maxTurn:
+            value = max(value, score)
+            alpha = max(alpha, value)
+        else:
+            value = min(value, score)
+            beta = min(beta, value)
+        if beta <= alpha:
+            break
+    return value
 
 
-def cuttingoff_search(board, currDepth, maxTurn, alpha, beta):
+def cuttingoff_search(board, currDepth, maxTurn, alpha, beta, tt=None, deadline=None, orderer=None, ply=0,
+                      stats=None, tablebase=None, quiescence=1, weights=DEFAULT_WEIGHTS):
     """
 
-    :param: board, currDepth, maxTurn, alpha, beta
+    :param: board, currDepth, maxTurn, alpha, beta, tt, deadline, orderer, ply, stats, tablebase,
+            quiescence, weights
     :return: best_move, value
 
     Cuttingoff_search is almost the same as alpha-beta pruning except for the base case.
-    The base case here used a cutoff test to reduce the levels of searching by evaluating
-    the chance of winning for both pieces or players.
+    When cutoff_test stops the search after currDepth plies, the position is evaluated by
+    quiescence_search, which follows captures and promotions for up to quiescence more plies
+    and scores the quiet positions with eval and the given weights. Without an orderer the
+    captures and promotions are searched first. Positions below the root found in a
+    Tablebase get their exact value without searching them.
     """
 
     best_move = ((0, 0), 0)
 
+    if stats is not None:
+        stats.node(ply)
+
+    if tablebase is not None and ply > 0:
+        value = tablebase.probe(board, maxTurn)
+        if value is not None:
+            if stats is not None:
+                stats.leaf(ply)
+            return best_move, board.get_score('O') + value
+
     # base case
     if cutoff_test(currDepth):
-        return eval(board, maxTurn)
+        return best_move, quiescence_search(board, maxTurn, alpha, beta, quiescence, weights, stats, ply, deadline)
+
+    if deadline is not None and timeit.default_timer() > deadline:
+        raise SearchTimeout()
+
+    side = 'O' if maxTurn else 'X'
+    moves = board.get_available_moves(side)
+
+    tt_move = None
+    if tt is not None:
+        key, mirrored = tt_key(board, maxTurn)
+        alpha_orig, beta_orig = alpha, beta
+        entry = tt.probe(key, board.get_score('O'))
+        if entry is not None:
+            depth, value, bound, tt_move = entry
+            if mirrored and tt_move is not None:
+                tt_move = mirror_action(tt_move, board.total_col)
+            if depth >= currDepth:
+                if bound == EXACT:
+                    return tt_move or best_move, value
+                if bound == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if beta <= alpha:
+                    return tt_move or best_move, value
+
+    if orderer is not None:
+        moves = orderer.order(board, moves, side, ply, tt_move)
+    else:
+        # the noisy moves change the evaluation most, so they cut off most often
+        noisy, quiet = split_noisy(board, moves, side)
+        moves = noisy + quiet
+        if tt_move in moves:
+            moves.remove(tt_move)
+            moves.insert(0, tt_move)
 
     if maxTurn:
         value = -1000
@@ -304,86 +679,298 @@ def cuttingoff_search(board, currDepth, maxTurn, alpha, beta):
 
     # do action -- for every piece of each player on the board, it will loop through
     # all the possible cases and choose the move with largest utility score
-    for piece in board.get_pieces('O' if maxTurn else 'X'):
-        for h_move in range(-1, 2):
-            if board.can_move(piece[0], piece[1], h_move, 'O' if maxTurn else 'X'):
-                copy_board = copy.deepcopy(board)
-                copy_board.make_move(piece[0], piece[1], h_move)
-
-                score = alpha_beta(copy_board, currDepth - 1, not maxTurn, alpha, beta)[1]  # recursive call
-
-                if maxTurn:
-                    if score >= value:
-                        value = score
-                        best_move = (piece, h_move)
-                        alpha = max(value, alpha)
-                        if beta <= alpha:
-                            break
+    for index, move in enumerate(moves):
+        piece, h_move = move
+        undo = board.make_move(piece[0], piece[1], h_move)
+        try:
+            if stats is not None:
+                start = stats.enter()
+            score = cuttingoff_search(board, currDepth - 1, not maxTurn, alpha, beta, tt, deadline, orderer,
+                                      ply + 1, stats, tablebase, quiescence, weights)[1]  # recursive call
+            if stats is not None:
+                stats.leave(ply + 1, start, move)
+        finally:
+            board.undo_move(undo)
+
+        if maxTurn:
+            if score > value or index == 0:
+                value = score
+                best_move = move
+                alpha = max(value, alpha)
+                if beta <= alpha:
+                    if orderer is not None:
+                        orderer.record_cutoff(board, move, side, ply, currDepth)
+                    if stats is not None:
+                        stats.cutoff(ply, index)
+                    break
 
-                else:
-                    if score <= value:
-                        value = score
-                        best_move = (piece, h_move)
-                        beta = min(value, beta)
-                        if beta <= alpha:
-                            break
+        else:
+            if score < value or index == 0:
+                value = score
+                best_move = move
+                beta = min(value, beta)
+                if beta <= alpha:
+                    if orderer is not None:
+                        orderer.record_cutoff(board, move, side, ply, currDepth)
+                    if stats is not None:
+                        stats.cutoff(ply, index)
+                    break
+
+    if tt is not None:
+        store_result(tt, key, board, currDepth, value, alpha_orig, beta_orig, best_move if moves else None, mirrored)
 
     return best_move, value
 
 
-def q_learning_train(g, row, col, num_training_iter):
-    player1 = QLearningPlayer('X')
-    player2 = QLearningPlayer('O')
+def principal_variation(board, tt, maxTurn, depth):
+    """
+    :param: board, tt, maxTurn, depth
+    :return: list of moves
 
-    win_list = [0, 0]
+    Follow the best moves stored in the transposition table from the current
+    position to rebuild the principal variation of the last search.
+    """
+    pv = []
+    undos = []
+    for _ in range(depth):
+        key, mirrored = tt_key(board, maxTurn)
+        entry = tt.probe(key, board.get_score('O'))
+        if entry is None or entry[3] is None:
+            break
+        move = entry[3]
+        if mirrored:
+            move = mirror_action(move, board.total_col)
+        if not board.can_move(move[0][0], move[0][1], move[1], 'O' if maxTurn else 'X'):
+            break
+        pv.append(move)
+        undos.append(board.make_move(move[0][0], move[0][1], move[1]))
+        maxTurn = not maxTurn
+    for undo in reversed(undos):
+        board.undo_move(undo)
+    return pv
+
+
+def iterative_deepening(board, max_depth, maxTurn, time_budget_ms=None, search=alpha_beta, tt=None, start_depth=1,
+                        orderer=None, stats=None, tablebase=None):
+    """
+    :param: board, max_depth, maxTurn, time_budget_ms, search, tt, start_depth, orderer, stats, tablebase
+    :return: best_move, value, depth reached
+
+    Run search (alpha_beta or cuttingoff_search) at increasing depths until max_depth
+    or until the time budget in milliseconds runs out, and return the best move of the
+    deepest completed iteration. All iterations share one transposition table, so the
+    principal variation of the previous iteration is searched first, and one MoveOrderer
+    whose killers and history carry over between iterations.
+    """
+    if tt is None:
+        tt = TranspositionTable()
+    if orderer is None:
+        orderer = MoveOrderer()
+    deadline = None
+    if time_budget_ms is not None:
+        deadline = timeit.default_timer() + time_budget_ms / 1000.0
+
+    result = None
+    for depth in range(start_depth, max_depth + 1):
+        try:
+            best_move, value = search(board, depth, maxTurn, -1000, 1000, tt, deadline, orderer, 0, stats, tablebase)
+        except SearchTimeout:
+            break
+        result = (best_move, value, depth)
+
+    if result is None:
+        # not even the first iteration finished, fall back to the first legal move
+        moves = board.get_available_moves('O' if maxTurn else 'X')
+        pv = principal_variation(board, tt, maxTurn, 1)
+        return (pv[0] if pv else moves[0] if moves else ((0, 0), 0)), None, 0
+    return result
+
+
+def compare_ordering(board, depth, maxTurn=True):
+    """
+    :param: board, depth, maxTurn
+    :return: dict of results with move ordering off and on
+
+    Run alpha_beta on the same position in scan order and with move ordering and a
+    transposition table, and report the node counts, the effective branching factor
+    (nodes ** (1 / depth)) and the time of each run.
+    """
+    report = {}
+    for name, enabled in (('off', False), ('on', True)):
+        stats = SearchStats()
+        tt = TranspositionTable() if enabled else None
+        best_move, value = stats.measure(alpha_beta, board, depth, maxTurn, -1000, 1000, tt, None, MoveOrderer(enabled))
+        report[name] = {
+            'best_move': best_move,
+            'value': value,
+            'nodes': stats.total_nodes(),
+            'branching_factor': stats.total_nodes() ** (1.0 / depth),
+            'time': stats.seconds[0],
+            'first_move_cutoff_rate': stats.to_dict()['first_move_cutoff_rate'],
+        }
+    return report
+
+
+def play_training_game(g, player1, player2, stats=None):
+    """
+    :param: g, player1, player2, stats
+    :return: the finished game
 
-    print("Training {} iterations...".format(num_training_iter))
-    for i in range(1, num_training_iter + 1):
-        counter = 0
-        is_game = True
-        game = copy.deepcopy(g)
+    Play one self-play game from a copy of g, player1 moving first, with
+    both players learning from every move. A SearchStats passed as stats
+    counts the copy.
+    """
+    counter = 0
+    is_game = True
+    game = copy.deepcopy(g)
+    if stats is not None:
+        stats.copy()
 
-        while is_game:
+    while is_game:
 
-            # counter used for switching player. This is human player's turn.
-            if counter % 2 == 0:
-                is_game = not player1.complete_move(game)
+        # counter used for switching player. This is human player's turn.
+        if counter % 2 == 0:
+            is_game = not player1.complete_move(game)
 
-            else:
-                is_game = not player2.complete_move(game)
-            counter += 1
+        else:
+            is_game = not player2.complete_move(game)
+        counter += 1
 
-        rewards = game.get_reward()
-        win_idx = rewards.index(max(rewards))
-        win_list[win_idx] += 1
+    player1.end_episode()
+    player2.end_episode()
+    return game
 
-        if i % 100 == 0:
-            print(game)
-            print("{}/{} done.".format(i, num_training_iter))
+
+def training_stream(g, player1, player2, num_training_iter, report_every=100, win_list=None, start=0):
+    """
+    :param: g, player1, player2, num_training_iter, report_every, win_list, start
+    :return: generator of metrics dicts
+
+    Play the training games start + 1 to num_training_iter and yield the
+    metrics of every report_every games, and of the last ones: games done,
+    games/sec, the share of the games each side won, the size of both Q
+    tables and the mean absolute TD error of the moves learned. win_list
+    counts the wins of 'X' and 'O' by rewards, as q_learning_train does,
+    and is updated in place.
+    """
+    if win_list is None:
+        win_list = [0, 0]
+    players = (player1, player2)
+    i = start
+    while i < num_training_iter:
+        batch = min(report_every, num_training_iter - i)
+        wins = [0, 0]
+        td_error_sum = sum(p.td_error_sum for p in players)
+        td_updates = sum(p.td_updates for p in players)
+        begin = timeit.default_timer()
+        for _ in range(batch):
+            game = play_training_game(g, player1, player2)
+            rewards = game.get_reward()
+            wins[rewards.index(max(rewards))] += 1
+        seconds = timeit.default_timer() - begin
+        i += batch
+        win_list[0] += wins[0]
+        win_list[1] += wins[1]
+        updates = sum(p.td_updates for p in players) - td_updates
+        yield {
+            'games': i,
+            'games_per_sec': batch / seconds if seconds else 0.0,
+            'win_rate_x': wins[0] / batch,
+            'win_rate_o': wins[1] / batch,
+            'q_entries': len(player1.q) + len(player2.q),
+            'mean_td_error': (sum(p.td_error_sum for p in players) - td_error_sum) / updates if updates else 0.0,
+            'win_list': list(win_list),
+        }
+
+
+def q_learning_train(g, row, col, num_training_iter, trace_lambda=0.0, replay_size=0, symmetry=False,
+                     report_every=100, callback=None, verbose=True, checkpoint=None, checkpoint_every=1000,
+                     resume=False):
+    """
+    :param: g, row, col, num_training_iter, trace_lambda, replay_size, symmetry,
+            report_every, callback, verbose, checkpoint, checkpoint_every, resume
+    :return: the player with more wins
+
+    Train two Q-learners against each other. trace_lambda and replay_size
+    switch on eligibility traces and experience replay for both of them, and
+    with symmetry they store mirrored positions once.
+
+    The metrics of training_stream are passed to callback every report_every
+    games and printed as one line when verbose. With a checkpoint path both
+    Q tables are saved there every checkpoint_every games and at the end;
+    with resume, training goes on from the games of that checkpoint.
+    """
+    mirror = Mirror(row, col) if symmetry else None
+    player1 = QLearningPlayer('X', trace_lambda=trace_lambda, replay_size=replay_size, mirror=mirror)
+    player2 = QLearningPlayer('O', trace_lambda=trace_lambda, replay_size=replay_size, mirror=mirror)
+
+    win_list = [0, 0]
+    start = 0
+    if checkpoint is not None and resume:
+        saved = load_checkpoint(checkpoint, (player1, player2), row, col)
+        if saved is not None:
+            start = saved['games']
+            win_list = saved['win_list']
+            if verbose:
+                print("Resuming from {} after {} games.".format(checkpoint, start))
+        elif verbose and os.path.exists(checkpoint):
+            print("{} is for another board size, starting a new run that replaces it.".format(checkpoint))
+
+    if verbose:
+        print("Training {} iterations...".format(num_training_iter))
+    saved_games = start
+    for metrics in training_stream(g, player1, player2, num_training_iter, report_every, win_list, start):
+        if callback is not None:
+            callback(metrics)
+        if verbose:
+            print("{games}/{total} done. {games_per_sec:.0f} games/sec, X won {win_rate_x:.0%}, O won {win_rate_o:.0%}, "
+                  "{q_entries} Q entries, mean TD error {mean_td_error:.2f}".format(total=num_training_iter, **metrics))
+        if checkpoint is not None and metrics['games'] - saved_games >= checkpoint_every:
+            save_checkpoint(checkpoint, (player1, player2), metrics['games'], win_list, row, col)
+            saved_games = metrics['games']
+    if checkpoint is not None and saved_games < num_training_iter:
+        save_checkpoint(checkpoint, (player1, player2), num_training_iter, win_list, row, col)
 
     player_idx = win_list.index(max(win_list))
 
     if player_idx == 0:
-        print("Player: {}".format('O'))
+        if verbose:
+            print("Player: {}".format('O'))
         return player1
 
     else:
-        print("Player: {}".format('X'))
+        if verbose:
+            print("Player: {}".format('X'))
         return player2
 
 
-def play(g, algo_choice, depth, q_player):
+def play(g, algo_choice, depth, q_player, time_budget_ms=None, workers=1, tablebase=None, mcts=None, stats=None):
     """
 
-    :param: g, algo_choice, depth, q_player
+    :param: g, algo_choice, depth, q_player, time_budget_ms, workers, tablebase, mcts, stats
     :return: None
 
-    Activate game for each algorithm
+    Activate game for each algorithm. With a time budget, alpha-beta and
+    cutting-off search deepen iteratively up to depth within the budget.
+    With more than one worker, minimax and alpha-beta without a time budget
+    search the root moves in parallel processes. With a Tablebase of the
+    board the search agents play its exact best move. The MCTS searcher
+    keeps its tree from one move to the next. A SearchStats passed as stats
+    counts the board copies made for the agent.
     """
     counter = 0
     is_game = True
     print(g)
 
+    executor = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from ParallelSearch import parallel_minimax, parallel_alpha_beta
+        executor = ProcessPoolExecutor(workers)
+
+    if algo_choice == 5 and mcts is None:
+        mcts = MCTS(time_budget_ms=time_budget_ms or 2000)
+
     while is_game:
 
         # counter used for switching player. This is human player's turn.
@@ -412,21 +999,44 @@ def play(g, algo_choice, depth, q_player):
         else:
             # Make a copy of the board for search trees
             simulate_board = copy.deepcopy(g)
+            if stats is not None:
+                stats.copy()
 
             start = timeit.default_timer()  # Time calculator
 
+            player_move = None
+            if tablebase is not None and algo_choice != 4:
+                player_move = tablebase.best_move(simulate_board, True)
+
             # For each choice, run different algorithm
-            if algo_choice == 1:
-                player_move = minimax(simulate_board, depth, True)[0]
+            if player_move is not None:
+                print('Tablebase move')
+            elif algo_choice == 1 and executor is not None:
+                player_move = parallel_minimax(simulate_board, depth, True, workers, executor)[0]
+            elif algo_choice == 1:
+                player_move = minimax(simulate_board, depth, True, tablebase=tablebase)[0]
+            elif algo_choice == 2 and time_budget_ms is not None:
+                player_move, _, reached = iterative_deepening(simulate_board, depth, True, time_budget_ms,
+                                                              tablebase=tablebase)
+                print('Depth ', reached)
+            elif algo_choice == 2 and executor is not None:
+                player_move = parallel_alpha_beta(simulate_board, depth, True, -1000, 1000, workers, False, executor)[0]
             elif algo_choice == 2:
-                player_move = alpha_beta(simulate_board, depth, True, -1000, 1000)[0]
+                player_move = alpha_beta(simulate_board, depth, True, -1000, 1000, tablebase=tablebase)[0]
+            elif algo_choice == 3 and time_budget_ms is not None:
+                player_move, _, reached = iterative_deepening(simulate_board, depth, True, time_budget_ms,
+                                                              search=cuttingoff_search, tablebase=tablebase)
+                print('Depth ', reached)
             elif algo_choice == 3:
-                player_move = cuttingoff_search(simulate_board, depth, True, -1000, 1000)[0]
+                player_move = cuttingoff_search(simulate_board, depth, True, -1000, 1000, tablebase=tablebase)[0]
+            elif algo_choice == 5:
+                player_move = mcts.choose_move(simulate_board, 'O')
+                print('Iterations ', mcts.last_iterations)
 
             else:
 
                 actions = g.get_available_moves('O')
-                state = g.get_state()
+                state = encode_state(g.get_state())
                 qs = [q_player.getQ(state,a) for a in actions]
                 maxQ = max(qs)
                 player_move = q_player.choose_action(state, actions)
@@ -453,6 +1063,9 @@ def play(g, algo_choice, depth, q_player):
             if g.game_finish('O'):
                 is_game = False
 
+    if executor is not None:
+        executor.shutdown()
+
 
 def main():
 
@@ -460,15 +1073,30 @@ def main():
  
     # This is the depth of search tree
     depth = 4
+
+    # Time budget of the agent's alpha-beta and cutting-off search per move in milliseconds
+    time_budget_ms = 2000
+
+    # Number of processes for minimax and alpha-beta without a time budget
+    workers = 1
+
+    # Tablebase file made by Tablebase.py, used by the search agents when it exists
+    tablebase_file = 'tablebase_{}x{}.tb'
+
+    # Q-learning stores a position and its mirror image once
+    symmetry = True
+
+    # MCTS iterations per move; the time budget above stops it earlier
+    mcts_iterations = 20000
  
     # Check validity of inputs
     while(check_input):
         row = int(input('How many rows you want for the board game?'))
         col = int(input('How many columns?'))
         print('Which algorithm you would like to run this game?') 
-        print('1. Minimax 2. Alpha-beta 3. Cutting-off search. 4. QLearning')
-        choice = int(input('Please enter between 1 to 4: '))
-        if row <= 0 or col <= 0 or choice < 1 or choice < 1 or choice > 4:
+        print('1. Minimax 2. Alpha-beta 3. Cutting-off search. 4. QLearning 5. MCTS')
+        choice = int(input('Please enter between 1 to 5: '))
+        if row <= 0 or col <= 0 or choice < 1 or choice < 1 or choice > 5:
             check_input = True
         else:
             check_input = False
@@ -476,14 +1104,37 @@ def main():
     # call class game constructor
     g = Game(row, col)
     q_player = None
+    tablebase = None
+    mcts = None
 
-    if choice == 4:
-        num_training_iter = int(input('How many training iterations?'))
-        q_player = q_learning_train(g, g.total_row, g.total_col, num_training_iter)
+    if choice != 4 and os.path.exists(tablebase_file.format(row, col)):
+        tablebase = Tablebase(tablebase_file.format(row, col))
 
+    if choice == 4:
+        q_file = input('Q-table file to load or save (leave blank to skip): ').strip()
+        while q_file and os.path.exists(q_file):
+            q_player = load_player(q_file)
+            if (q_player.q.rows, q_player.q.cols) == (row, col):
+                break
+            # never save the new table over one trained for another board
+            print("{} was trained on a {}x{} board.".format(q_file, q_player.q.rows, q_player.q.cols))
+            q_player = None
+            q_file = input('Another Q-table file to load or save (leave blank to skip): ').strip()
+
+        if q_player is None:
+            num_training_iter = int(input('How many training iterations?'))
+            # training goes on from the checkpoint of an interrupted run
+            q_player = q_learning_train(g, g.total_row, g.total_col, num_training_iter, symmetry=symmetry,
+                                        checkpoint=q_file + '.ckpt' if q_file else None, resume=True)
+            if q_file:
+                q_player.save(q_file, row, col)
+
+
+    if choice == 5:
+        mcts = MCTS(mcts_iterations, time_budget_ms)
 
     # Play games between human player and agent
-    play(g, choice, depth, q_player)
+    play(g, choice, depth, q_player, time_budget_ms, workers, tablebase, mcts)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+"""
+Client for GameServer.py.
+
+    python3 GameClient.py --port 8765 --agent alpha_beta:4 --size 6 6
+    python3 GameClient.py --metrics
+    python3 GameClient.py --random-games 200 --concurrency 50
+
+Without options it plays one game at the terminal with the same prompts as
+play(). --random-games plays many games with random moves at once to load
+the server, retrying moves the server answers "busy", and prints the server
+metrics at the end.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+
+
+async def connect(args):
+    if args.unix:
+        return await asyncio.open_unix_connection(args.unix)
+    return await asyncio.open_connection(args.host, args.port)
+
+
+async def request(reader, writer, message):
+    """
+    Send one request and return the response
+    """
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("server closed the connection")
+    return json.loads(line)
+
+
+async def play_terminal(args):
+    reader, writer = await connect(args)
+    loop = asyncio.get_running_loop()
+    state = await request(reader, writer, {'op': 'new', 'rows': args.size[0], 'cols': args.size[1],
+                                           'agent': args.agent, 'time_budget_ms': args.time_budget_ms})
+    if not state['ok']:
+        print(state['error'])
+        return
+    print(state['board'])
+    while not state['finished']:
+        x = int(await loop.run_in_executor(None, input, 'Please enter x coordinate you want to move:'))
+        y = int(await loop.run_in_executor(None, input, 'Please enter y coordinate you want to move:'))
+        step = int(await loop.run_in_executor(None, input, 'Please enter horizontal moves you want:'))
+        response = await request(reader, writer, {'op': 'move', 'session': state['session'],
+                                                  'row': x, 'col': y, 'h': step})
+        if not response['ok']:
+            print("Invalid move, please re-enter." if response['error'] == 'invalid move' else response['error'])
+            continue
+        state = response
+        if 'agent_move' in state:
+            print('Agent ', state['agent_move'], 'Time ', state['think_ms'])
+        print(state['board'])
+    print('Winner ', state['winner'])
+    writer.close()
+
+
+async def play_random_game(args, rng):
+    reader, writer = await connect(args)
+    busy = 0
+    try:
+        state = await request(reader, writer, {'op': 'new', 'rows': args.size[0], 'cols': args.size[1],
+                                               'agent': args.agent, 'time_budget_ms': args.time_budget_ms})
+        while state['ok'] and not state['finished'] and state['available']:
+            (row, col), h_move = rng.choice(state['available'])
+            response = await request(reader, writer, {'op': 'move', 'session': state['session'],
+                                                      'row': row, 'col': col, 'h': h_move})
+            if not response['ok'] and response['error'] == 'busy':
+                busy += 1
+                await asyncio.sleep(0.05 * rng.random())
+                continue
+            state = response
+        return busy
+    finally:
+        writer.close()
+
+
+async def play_random(args):
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        async with semaphore:
+            return await play_random_game(args, rng)
+
+    busy = await asyncio.gather(*[one() for _ in range(args.random_games)])
+    print("{} games, {} busy answers".format(args.random_games, sum(busy)))
+    await print_metrics(args)
+
+
+async def print_metrics(args):
+    reader, writer = await connect(args)
+    print(json.dumps(await request(reader, writer, {'op': 'metrics'}), indent=2))
+    writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='connect to this Unix socket instead of TCP')
+    parser.add_argument('--agent', default='alpha_beta:4')
+    parser.add_argument('--size', type=int, nargs=2, default=[6, 6], metavar=('ROWS', 'COLS'))
+    parser.add_argument('--time-budget-ms', type=int)
+    parser.add_argument('--metrics', action='store_true', help='print the server metrics and exit')
+    parser.add_argument('--random-games', type=int, help='play this many games with random moves')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        asyncio.run(print_metrics(args))
+    elif args.random_games:
+        asyncio.run(play_random(args))
+    else:
+        asyncio.run(play_terminal(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
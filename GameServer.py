@@ -0,0 +1,379 @@
+"""
+Session server for playing against the agents over the network.
+
+    python3 GameServer.py --port 8765 --workers 4
+    python3 GameServer.py --unix /tmp/boardgame.sock
+
+Every connection sends one JSON object per line and gets one JSON object per
+line back, in order. The human plays 'X' and moves first, the agent plays
+'O', like play(). Requests:
+
+    {"op": "new", "rows": 6, "cols": 6, "agent": "alpha_beta:4", "time_budget_ms": 500}
+    {"op": "move", "session": 1, "row": 5, "col": 0, "h": 0}
+    {"op": "state", "session": 1}
+    {"op": "close", "session": 1}
+    {"op": "metrics"}
+
+Agents are given as in MatchRunner, limited to the agent names of AGENTS, to
+max_depth plies and max_iterations MCTS iterations. Every search gets a time
+budget, default_budget_ms unless the request asks for one up to
+max_budget_ms. qlearning agents load their Q-table by file name from the
+directory given with --q-dir only, and are refused without one.
+
+Searches run on a bounded process pool; when more than max_pending searches
+are waiting the server answers "busy" instead of queueing more, and a search
+that runs well past the session time budget is abandoned for the first legal
+move.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import timeit
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from Game import Game
+from MatchRunner import get_agent, SEARCHES
+from SearchStats import percentile
+
+# agent names a client may ask for
+AGENTS = tuple(SEARCHES) + ('mcts', 'qlearning', 'random')
+
+
+def _choose_move(spec, board):
+    """
+    Worker task: return the agent move for 'O' on board and the think time
+    """
+    start = timeit.default_timer()
+    move = get_agent(spec, board.total_row, board.total_col).choose_move(board, 'O')
+    return move, (timeit.default_timer() - start) * 1000
+
+
+class Session:
+    """One game of a human ('X') against an agent ('O')"""
+
+    def __init__(self, session_id, row, col, agent, time_budget_ms):
+        self.id = session_id
+        self.game = Game(row, col)
+        self.agent = agent
+        self.time_budget_ms = time_budget_ms
+        self.busy = False
+        self.finished = False
+        self.moves = 0
+
+    def to_dict(self):
+        g = self.game
+        result = {
+            'session': self.id,
+            'board': str(g),
+            'score': g.get_score('X'),
+            'rewards': list(g.get_reward()),
+            'moves': self.moves,
+            'finished': self.finished,
+            'available': g.get_available_moves('X'),
+        }
+        if self.finished:
+            score = g.get_score('X')
+            result['winner'] = 'X' if score > 0 else 'O' if score < 0 else 'draw'
+        return result
+
+
+class GameServer:
+    """
+    Holds the sessions and the process pool that runs the agent searches.
+
+    max_pending bounds the searches submitted to the pool and not finished
+    yet; requests that would need another one are answered with "busy".
+    A search is abandoned after timeout_factor times the session time budget
+    plus one second. Latencies of the last searches are kept for metrics.
+    """
+
+    def __init__(self, workers=None, max_pending=None, max_sessions=1000, max_size=20, timeout_factor=2.0,
+                 max_depth=8, max_iterations=100000, default_budget_ms=1000, max_budget_ms=10000, q_dir=None):
+        if workers is None:
+            workers = os.cpu_count()
+        if max_pending is None:
+            max_pending = 4 * workers
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_sessions = max_sessions
+        self.max_size = max_size
+        self.timeout_factor = timeout_factor
+        self.max_depth = max_depth
+        self.max_iterations = max_iterations
+        self.default_budget_ms = default_budget_ms
+        self.max_budget_ms = max_budget_ms
+        self.q_dir = q_dir
+        self.executor = ProcessPoolExecutor(workers)
+        self.sessions = {}
+        self.next_id = 1
+        self.pending = 0
+        self.latencies = deque(maxlen=1000)
+        self.think_times = deque(maxlen=1000)
+        self.counters = {'requests': 0, 'searches': 0, 'busy': 0, 'timeouts': 0, 'errors': 0}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def handle(self, reader, writer):
+        """
+        Serve one connection. Requests are answered one at a time and the
+        next line is only read after the answer is written, so a client
+        that does not read its answers stops being served.
+        """
+        owned = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                start = timeit.default_timer()
+                try:
+                    response = await self.dispatch(json.loads(line), owned)
+                # OverflowError: int() of a number JSON read as inf, like 1e999
+                except (ValueError, KeyError, TypeError, OverflowError) as error:
+                    self.counters['errors'] += 1
+                    response = {'ok': False, 'error': str(error)}
+                response['server_ms'] = (timeit.default_timer() - start) * 1000
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for session_id in owned:
+                self.sessions.pop(session_id, None)
+            writer.close()
+
+    async def dispatch(self, request, owned):
+        """
+        :param: request dict, owned (ids of the sessions of the connection)
+        :return: response dict
+        """
+        self.counters['requests'] += 1
+        if not isinstance(request, dict):
+            raise ValueError('a request must be a JSON object')
+        op = request.get('op')
+        if op == 'metrics':
+            return dict(self.metrics(), ok=True)
+        if op == 'new':
+            return self.new_session(request, owned)
+        session_id = request.get('session')
+        # a connection only reaches the sessions it opened
+        session = self.sessions.get(session_id) if session_id in owned else None
+        if session is None:
+            return {'ok': False, 'error': 'unknown session'}
+        if op == 'state':
+            return dict(session.to_dict(), ok=True)
+        if op == 'close':
+            del self.sessions[session.id]
+            owned.discard(session.id)
+            return {'ok': True, 'session': session.id}
+        if op == 'move':
+            return await self.human_move(session, int(request['row']), int(request['col']), int(request['h']))
+        return {'ok': False, 'error': 'unknown op {}'.format(op)}
+
+    def agent_spec(self, spec, time_budget_ms):
+        """
+        :param: spec and time_budget_ms of a new session request
+        :return: agent spec with the time budget in it, time budget
+
+        Check a client agent spec against the limits of the server. Raises
+        ValueError for an agent the server does not play.
+        """
+        if not isinstance(spec, str):
+            raise ValueError('agent must be a string')
+        parts = spec.split(':')
+        name = parts[0]
+        if name not in AGENTS:
+            raise ValueError('unknown agent {}'.format(name))
+        if time_budget_ms is None and len(parts) > 2 and name != 'qlearning':
+            time_budget_ms = parts[2]
+        if time_budget_ms is None:
+            time_budget_ms = self.default_budget_ms
+        time_budget_ms = min(max(int(time_budget_ms), 1), self.max_budget_ms)
+        if name in SEARCHES:
+            depth = int(parts[1]) if len(parts) > 1 else 3
+            if not 1 <= depth <= self.max_depth:
+                raise ValueError('depth must be 1 to {}'.format(self.max_depth))
+            return '{}:{}:{}'.format(name, depth, time_budget_ms), time_budget_ms
+        if name == 'mcts':
+            iterations = int(parts[1]) if len(parts) > 1 else 1000
+            if not 1 <= iterations <= self.max_iterations:
+                raise ValueError('iterations must be 1 to {}'.format(self.max_iterations))
+            return 'mcts:{}:{}'.format(iterations, time_budget_ms), time_budget_ms
+        if name == 'qlearning':
+            table = ':'.join(parts[1:])
+            if self.q_dir is None:
+                raise ValueError('qlearning agents are not enabled')
+            # a bare file name inside q_dir, never a path chosen by the client
+            if not table or os.path.basename(table) != table or table.startswith('.'):
+                raise ValueError('unknown Q-table {}'.format(table))
+            return 'qlearning:{}'.format(os.path.join(self.q_dir, table)), time_budget_ms
+        return name, time_budget_ms
+
+    def new_session(self, request, owned):
+        row = int(request.get('rows', 6))
+        col = int(request.get('cols', 6))
+        if not 3 <= row <= self.max_size or not 3 <= col <= self.max_size:
+            return {'ok': False, 'error': 'board must be 3 to {} squares each way'.format(self.max_size)}
+        if len(self.sessions) >= self.max_sessions:
+            self.counters['busy'] += 1
+            return {'ok': False, 'error': 'busy'}
+        spec, time_budget_ms = self.agent_spec(request.get('agent', 'alpha_beta:4'), request.get('time_budget_ms'))
+        try:
+            agent = get_agent(spec, row, col)
+        except Exception:
+            if not spec.startswith('qlearning:'):
+                raise
+            # the same answer whether the file is missing, unreadable or for another board
+            raise ValueError('unknown Q-table {} for a {}x{} board'.format(os.path.basename(spec), row, col))
+        if 'O' not in agent.sides:
+            raise ValueError("{} was not trained to play 'O'".format(os.path.basename(spec)))
+
+        session = Session(self.next_id, row, col, spec, time_budget_ms)
+        self.next_id += 1
+        self.sessions[session.id] = session
+        owned.add(session.id)
+        return dict(session.to_dict(), ok=True)
+
+    async def human_move(self, session, row, col, h_move):
+        if session.busy:
+            return {'ok': False, 'error': 'session busy'}
+        if session.finished:
+            return {'ok': False, 'error': 'game finished'}
+        g = session.game
+        # can_move does not check h_move, so test against the legal moves
+        if ((row, col), h_move) not in g.get_available_moves('X'):
+            return {'ok': False, 'error': 'invalid move'}
+        if self.pending >= self.max_pending:
+            # shed load before changing the game, so the client can retry
+            self.counters['busy'] += 1
+            return {'ok': False, 'error': 'busy', 'queue_depth': self.queue_depth()}
+
+        g.make_move(row, col, h_move)
+        session.moves += 1
+        session.finished = g.game_finish('X')
+        response = {}
+        session.busy = True
+        try:
+            # the agent moves again while the human has no legal move
+            while not session.finished:
+                available = g.get_available_moves('O')
+                if not available:
+                    session.finished = not g.get_available_moves('X')
+                    break
+                move, think_ms, timed_out = await self.agent_move(session, available)
+                g.make_move(move[0][0], move[0][1], move[1])
+                session.moves += 1
+                response.update(agent_move=move, think_ms=think_ms, timeout=timed_out)
+                session.finished = g.game_finish('O')
+                if session.finished or g.get_available_moves('X'):
+                    break
+        finally:
+            session.busy = False
+        response.update(session.to_dict(), ok=True)
+        return response
+
+    async def agent_move(self, session, available):
+        """
+        Run the agent search of session on the pool and return its move, the
+        think time and whether the search was abandoned
+        """
+        loop = asyncio.get_running_loop()
+        timeout = session.time_budget_ms * self.timeout_factor / 1000.0 + 1
+        start = timeit.default_timer()
+        future = self.executor.submit(_choose_move, session.agent, session.game)
+        self.pending += 1
+        self.counters['searches'] += 1
+
+        def done(_):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._search_done)
+
+        # an abandoned search keeps its worker busy until it finishes, so it
+        # stays pending until the pool is done with it
+        future.add_done_callback(done)
+        try:
+            move, think_ms = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+            timed_out = False
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            move, think_ms, timed_out = available[0], None, True
+        finally:
+            self.latencies.append(timeit.default_timer() - start)
+        if move not in available:
+            # minimax returns ((0, 0), 0) when every move loses score
+            move = available[0]
+        if think_ms is not None:
+            self.think_times.append(think_ms)
+        return move, think_ms, timed_out
+
+    def _search_done(self):
+        self.pending -= 1
+
+    def queue_depth(self):
+        """
+        Return the number of searches waiting for a free worker
+        """
+        return max(0, self.pending - self.workers)
+
+    def metrics(self):
+        """
+        Return the session count, pool load, counters and the p50/p99 of the
+        latency (queueing included) and think time of the last searches
+        """
+        result = {
+            'sessions': len(self.sessions),
+            'workers': self.workers,
+            'pending': self.pending,
+            'queue_depth': self.queue_depth(),
+            'max_pending': self.max_pending,
+        }
+        result.update(self.counters)
+        for name, values, scale in (('latency', self.latencies, 1000), ('think', self.think_times, 1)):
+            if values:
+                result[name + '_p50_ms'] = percentile(values, 50) * scale
+                result[name + '_p99_ms'] = percentile(values, 99) * scale
+        return result
+
+
+async def serve(server, host='127.0.0.1', port=8765, unix=None):
+    if unix is not None:
+        listener = await asyncio.start_unix_server(server.handle, path=unix)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, help='search processes (default: all CPUs)')
+    parser.add_argument('--max-pending', type=int, help='searches in flight before answering busy')
+    parser.add_argument('--max-sessions', type=int, default=1000)
+    parser.add_argument('--max-depth', type=int, default=8, help='deepest search a client may ask for')
+    parser.add_argument('--max-iterations', type=int, default=100000, help='most MCTS iterations a client may ask for')
+    parser.add_argument('--default-budget-ms', type=int, default=1000, help='time budget of a search when none is given')
+    parser.add_argument('--max-budget-ms', type=int, default=10000, help='largest time budget a client may ask for')
+    parser.add_argument('--q-dir', help='directory of the Q-tables qlearning agents may load')
+    args = parser.parse_args(argv)
+
+    server = GameServer(args.workers, args.max_pending, args.max_sessions, max_depth=args.max_depth,
+                        max_iterations=args.max_iterations, default_budget_ms=args.default_budget_ms,
+                        max_budget_ms=args.max_budget_ms, q_dir=args.q_dir)
+    where = args.unix or '{}:{}'.format(args.host, args.port)
+    print("Serving on {} with {} workers".format(where, server.workers), file=sys.stderr)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Monte Carlo tree search (UCT) agent.
+
+Every iteration walks down the tree from the root picking the child with the
+best upper confidence bound, adds the children of the first node that has
+none yet, plays one random game from there and counts its result in every
+node on the path. All of it runs on the board it is given with make_move
+and undo_move, so no position is ever copied during the search.
+
+The tree is a pool of parallel arrays indexed by node number. The children
+of a node are added together and take consecutive numbers, so a node only
+records its first child and how many there are. After the search the tree
+is kept, and the next choose_move starts from the subtree of the position
+it is given when that position follows the last root by one or two moves.
+"""
+import copy
+import math
+import random
+import timeit
+from array import array
+
+
+class MCTS:
+    """
+    A UCT searcher that stops after iterations iterations or time_budget_ms
+    milliseconds, whichever comes first; one of them has to be given. c is
+    the exploration constant and playout_limit caps the moves of a random
+    game (2 * rows * cols by default). A SearchStats passed as stats counts
+    the copies of the root board.
+    """
+
+    def __init__(self, iterations=None, time_budget_ms=None, c=1.4, playout_limit=None, seed=None, stats=None):
+        if iterations is None and time_budget_ms is None:
+            raise ValueError("MCTS needs an iteration count or a time budget")
+        self.iterations = iterations
+        self.time_budget_ms = time_budget_ms
+        self.c = c
+        self.playout_limit = playout_limit
+        self.rng = random.Random(seed)
+        self.stats = stats
+        self.root_board = None
+        self.root_side = None
+        self.last_iterations = 0
+        self.reused = 0
+        self._reset()
+
+    def _reset(self):
+        # parent, first child (-1 until expanded), child count, visits, terminal
+        # flag, summed results for the side that moved into the node, and move
+        self.parent = array('i', [-1])
+        self.first = array('i', [-1])
+        self.count = array('i', [0])
+        self.visits = array('i', [0])
+        self.terminal = array('b', [0])
+        self.wins = array('d', [0.0])
+        self.moves = [None]
+
+    def __len__(self):
+        return len(self.visits)
+
+    def _add_children(self, node, moves):
+        self.first[node] = len(self.visits)
+        self.count[node] = len(moves)
+        for move in moves:
+            self.parent.append(node)
+            self.first.append(-1)
+            self.count.append(0)
+            self.visits.append(0)
+            self.terminal.append(0)
+            self.wins.append(0.0)
+            self.moves.append(move)
+
+    def _reroot(self, new_root):
+        """
+        Keep only the subtree of new_root, renumbered from 0 breadth first
+        so the children of every node stay consecutive
+        """
+        parent = array('i', [-1])
+        first = array('i', [-1])
+        count = array('i', [self.count[new_root]])
+        visits = array('i', [self.visits[new_root]])
+        terminal = array('b', [self.terminal[new_root]])
+        wins = array('d', [self.wins[new_root]])
+        moves = [None]
+        queue = [new_root]
+        for new_node, old_node in enumerate(queue):
+            old_first = self.first[old_node]
+            if old_first < 0:
+                continue
+            first[new_node] = len(visits)
+            for old_child in range(old_first, old_first + self.count[old_node]):
+                queue.append(old_child)
+                parent.append(new_node)
+                first.append(-1)
+                count.append(self.count[old_child])
+                visits.append(self.visits[old_child])
+                terminal.append(self.terminal[old_child])
+                wins.append(self.wins[old_child])
+                moves.append(self.moves[old_child])
+        self.parent, self.first, self.count = parent, first, count
+        self.visits, self.terminal, self.wins, self.moves = visits, terminal, wins, moves
+
+    def _find_root(self, board, side):
+        """
+        Return the node of the position board with side to move among the
+        children and grandchildren of the last root, or -1
+        """
+        old = self.root_board
+        if old is None or (old.total_row, old.total_col) != (board.total_row, board.total_col):
+            return -1
+        frontier = [(0, self.root_side, ())]
+        for _ in range(2):
+            next_frontier = []
+            for node, to_move, path in frontier:
+                if self.first[node] < 0:
+                    continue
+                other = 'O' if to_move == 'X' else 'X'
+                for child in range(self.first[node], self.first[node] + self.count[node]):
+                    child_path = path + (self.moves[child],)
+                    undos = [old.make_move(m[0][0], m[0][1], m[1]) for m in child_path if m is not None]
+                    same = (other == side and old.hash == board.hash and old.get_score('X') == board.get_score('X'))
+                    for undo in reversed(undos):
+                        old.undo_move(undo)
+                    if same:
+                        return child
+                    next_frontier.append((child, other, child_path))
+            frontier = next_frontier
+        return -1
+
+    def choose_move(self, board, side):
+        """
+        :param: board, side to move (it must have a legal move)
+        :return: the most visited move of the root
+        """
+        node = self._find_root(board, side)
+        if node > 0:
+            self._reroot(node)
+            self.reused += 1
+        elif node < 0:
+            self._reset()
+        self.root_board = copy.deepcopy(board)
+        if self.stats is not None:
+            self.stats.copy()
+        self.root_side = side
+        self.search(board, side)
+
+        best = None
+        for child in range(self.first[0], self.first[0] + self.count[0]):
+            if best is None or self.visits[child] > self.visits[best]:
+                best = child
+        return self.moves[best]
+
+    def root_value(self):
+        """
+        Return the mean result of the root for the side to move, from 0 for a
+        loss to 1 for a win
+        """
+        if not self.visits[0]:
+            return 0.5
+        return 1 - self.wins[0] / self.visits[0]
+
+    def search(self, board, side):
+        """
+        Run iterations from the root position board with side to move until
+        the iteration count or the time budget is used up
+        """
+        self.limit = self.playout_limit or 2 * board.total_row * board.total_col
+        deadline = None
+        if self.time_budget_ms is not None:
+            deadline = timeit.default_timer() + self.time_budget_ms / 1000.0
+        done = 0
+        while self.iterations is None or done < self.iterations:
+            self._iterate(board, side)
+            done += 1
+            # the clock is read every few iterations only
+            if deadline is not None and done % 16 == 0 and timeit.default_timer() > deadline:
+                break
+        self.last_iterations = done
+
+    def _iterate(self, board, side):
+        first, count, visits, wins, terminal, moves = (self.first, self.count, self.visits, self.wins,
+                                                        self.terminal, self.moves)
+        node = 0
+        path = [0]
+        movers = ['O' if side == 'X' else 'X']
+        undos = []
+
+        # selection and expansion
+        while not terminal[node]:
+            if first[node] < 0:
+                available = board.get_available_moves(side)
+                if not available:
+                    other = 'O' if side == 'X' else 'X'
+                    if not board.get_available_moves(other):
+                        terminal[node] = 1
+                        break
+                    # a side without a legal move passes
+                    available = [None]
+                self._add_children(node, available)
+                first, count, visits, wins, terminal, moves = (self.first, self.count, self.visits, self.wins,
+                                                                self.terminal, self.moves)
+
+            start = first[node]
+            child = -1
+            log_visits = math.log(visits[node]) if visits[node] else 0.0
+            best = -1.0
+            for candidate in range(start, start + count[node]):
+                n = visits[candidate]
+                if n == 0:
+                    child = candidate
+                    break
+                score = wins[candidate] / n + self.c * math.sqrt(log_visits / n)
+                if score > best:
+                    best = score
+                    child = candidate
+
+            move = moves[child]
+            mover = side
+            if move is not None:
+                undos.append(board.make_move(move[0][0], move[0][1], move[1]))
+            side = 'O' if side == 'X' else 'X'
+            node = child
+            path.append(node)
+            movers.append(mover)
+            if visits[node] == 0:
+                if move is not None and board.game_finish(mover):
+                    terminal[node] = 1
+                break
+
+        # simulation
+        if terminal[node]:
+            result = _result(board)
+        else:
+            result = self._playout(board, side)
+        for undo in reversed(undos):
+            board.undo_move(undo)
+
+        # backpropagation: result is for 'X', each node keeps the results of
+        # the side that moved into it
+        for node, mover in zip(path, movers):
+            visits[node] += 1
+            wins[node] += result if mover == 'X' else 1 - result
+
+    def _playout(self, board, side):
+        """
+        Play random moves from board until the game ends and return the
+        result for 'X'; the board is restored
+        """
+        rng = self.rng
+        undos = []
+        passes = 0
+        for _ in range(self.limit):
+            available = board.get_available_moves(side)
+            if not available:
+                passes += 1
+                if passes == 2:
+                    break
+            else:
+                passes = 0
+                move = available[rng.randrange(len(available))]
+                undos.append(board.make_move(move[0][0], move[0][1], move[1]))
+                if board.game_finish(side):
+                    break
+            side = 'O' if side == 'X' else 'X'
+        result = _result(board)
+        for undo in reversed(undos):
+            board.undo_move(undo)
+        return result
+
+
+def _result(board):
+    """
+    Return 1 when 'X' is ahead on score, 0 when 'O' is and 0.5 for a draw
+    """
+    score = board.get_score('X')
+    if score > 0:
+        return 1.0
+    if score < 0:
+        return 0.0
+    return 0.5
+
+
+def mcts(board, maxTurn, iterations=None, time_budget_ms=None, c=1.4, seed=None):
+    """
+    :param: board, maxTurn, iterations, time_budget_ms, c, seed
+    :return: best move, expected result for the side to move (0 to 1)
+
+    One MCTS search from scratch, for callers that do not keep a searcher
+    between moves.
+    """
+    searcher = MCTS(iterations, time_budget_ms, c, seed=seed)
+    move = searcher.choose_move(board, 'O' if maxTurn else 'X')
+    return move, searcher.root_value()
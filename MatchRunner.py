@@ -0,0 +1,365 @@
+"""
+Headless agent-vs-agent matches and tournaments.
+
+    python3 MatchRunner.py alpha_beta:4 minimax:3 random --size 6 6 --games 100 --out games.jsonl
+    python3 MatchRunner.py alpha_beta:6:200 qlearning:q.bin --workers 4
+
+An agent is given as name[:depth[:time_budget_ms]] for minimax, alpha_beta and
+cuttingoff, mcts[:iterations[:time_budget_ms]], qlearning:<Q-table file> for a
+trained QLearningPlayer, or random.
+Every pair of agents plays the given number of games with each side. A Q-table
+is trained for one side, so a qlearning agent only plays that colour. Every
+game starts with a few seeded random opening moves, so two deterministic
+agents do not replay the same game. Games are spread over a process pool and
+every finished game is written as one JSON line; a summary with Elo estimates
+is printed at the end.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import timeit
+from concurrent.futures import ProcessPoolExecutor
+from Game import Game, minimax, alpha_beta, cuttingoff_search, iterative_deepening, SearchTimeout
+from MCTS import MCTS
+from QLearner import load_player
+from QTable import encode_state
+
+SEARCHES = {'minimax': minimax, 'alpha_beta': alpha_beta, 'cuttingoff': cuttingoff_search}
+
+# agents built by this process, by (spec, rows, cols)
+_agents = {}
+
+
+class Agent:
+    """
+    A non-interactive player built from an agent spec. choose_move returns
+    the move to make for side on board, which must have a legal move.
+    """
+
+    def __init__(self, spec, row, col):
+        self.spec = spec
+        parts = spec.split(':')
+        self.name = parts[0]
+        self.depth = 3
+        self.time_budget_ms = None
+        self.player = None
+        # the agent's own random generator, reseeded by new_game
+        self.rng = random.Random()
+        # the colours the agent can play
+        self.sides = ('X', 'O')
+        if self.name in SEARCHES:
+            if len(parts) > 1:
+                self.depth = int(parts[1])
+            if len(parts) > 2:
+                self.time_budget_ms = int(parts[2])
+        elif self.name == 'mcts':
+            self.iterations = int(parts[1]) if len(parts) > 1 else 1000
+            if len(parts) > 2:
+                self.time_budget_ms = int(parts[2])
+            # the tree is kept between the moves of a game, new_game starts a new one
+            self.player = MCTS(self.iterations, self.time_budget_ms)
+        elif self.name == 'qlearning':
+            if len(parts) < 2:
+                raise ValueError("qlearning needs a Q-table file: qlearning:<path>")
+            self.player = load_player(':'.join(parts[1:]))
+            if (self.player.q.rows, self.player.q.cols) != (row, col):
+                raise ValueError("{} was trained on a {}x{} board".format(spec, self.player.q.rows,
+                                                                          self.player.q.cols))
+            # play greedily, without exploration
+            self.player.epsilon = 0
+            self.player.rng = self.rng
+            self.sides = (self.player.side,)
+        elif self.name != 'random':
+            raise ValueError("unknown agent {}".format(spec))
+
+    def new_game(self, seed):
+        """
+        Forget what is kept from the previous game, so a game only depends on
+        its own seed whatever the process played before
+        """
+        self.rng.seed(seed)
+        if self.name == 'mcts':
+            self.player = MCTS(self.iterations, self.time_budget_ms, seed=seed)
+
+    def choose_move(self, board, side):
+        maxTurn = side == 'O'
+        if self.name == 'random':
+            return self.rng.choice(board.get_available_moves(side))
+        if self.name == 'qlearning':
+            return self.player.choose_action(encode_state(board.get_state()), board.get_available_moves(side))
+        if self.name == 'mcts':
+            return self.player.choose_move(board, side)
+        search = SEARCHES[self.name]
+        if search is minimax:
+            if self.time_budget_ms is None:
+                return minimax(board, self.depth, maxTurn)[0]
+            # deepen one ply at a time and keep the move of the deepest search that finished
+            deadline = timeit.default_timer() + self.time_budget_ms / 1000.0
+            move = board.get_available_moves(side)[0]
+            for depth in range(1, self.depth + 1):
+                try:
+                    move = minimax(board, depth, maxTurn, deadline=deadline)[0]
+                except SearchTimeout:
+                    break
+            return move
+        if self.time_budget_ms is not None:
+            return iterative_deepening(board, self.depth, maxTurn, self.time_budget_ms, search=search)[0]
+        return search(board, self.depth, maxTurn, -1000, 1000)[0]
+
+
+def get_agent(spec, row, col):
+    """
+    Return the Agent of spec, built once per process
+    """
+    agent = _agents.get((spec, row, col))
+    if agent is None:
+        agent = _agents[(spec, row, col)] = Agent(spec, row, col)
+    return agent
+
+
+def play_opening(g, plies, rng):
+    """
+    :param: g, plies, rng (random.Random)
+    :return: list of the moves played, side to move after them
+
+    Play up to plies random moves from the start, 'X' first, stopping before
+    a move that would finish the game or at a side without a legal move.
+    """
+    opening = []
+    side = 'X'
+    for _ in range(plies):
+        available = g.get_available_moves(side)
+        if not available:
+            break
+        move = rng.choice(available)
+        undo = g.make_move(move[0][0], move[0][1], move[1])
+        if g.game_finish(side):
+            g.undo_move(undo)
+            break
+        opening.append(move)
+        side = 'O' if side == 'X' else 'X'
+    return opening, side
+
+
+def play_match(spec_x, spec_o, row, col, seed=0, max_moves=None, opening_plies=0):
+    """
+    :param: spec_x, spec_o (agent specs), row, col, seed, max_moves, opening_plies
+    :return: result dict
+
+    Play one game, spec_x moving 'X' first, after opening_plies seeded random
+    moves. A side without a legal move passes; the game ends when the side
+    that moved finishes it, when neither side can move or after max_moves
+    moves (2 * row * col by default, the opening included). The winner is
+    decided by the sign of the score, like the score of Game: 'X' above zero,
+    'O' below and a draw at zero.
+    """
+    if max_moves is None:
+        max_moves = 2 * row * col
+    agents = {'X': get_agent(spec_x, row, col), 'O': get_agent(spec_o, row, col)}
+    agents['X'].new_game(2 * seed)
+    agents['O'].new_game(2 * seed + 1)
+    g = Game(row, col)
+    opening, side = play_opening(g, opening_plies, random.Random(seed))
+    think_ms = {'X': [], 'O': []}
+    illegal = {'X': 0, 'O': 0}
+    moves = len(opening)
+    passes = 0
+    finished = False
+
+    while not finished and moves < max_moves and passes < 2:
+        available = g.get_available_moves(side)
+        if not available:
+            passes += 1
+        else:
+            passes = 0
+            start = timeit.default_timer()
+            move = agents[side].choose_move(g, side)
+            think_ms[side].append((timeit.default_timer() - start) * 1000)
+            if move not in available:
+                # minimax returns ((0, 0), 0) when every move loses score
+                illegal[side] += 1
+                move = available[0]
+            g.make_move(move[0][0], move[0][1], move[1])
+            moves += 1
+            finished = g.game_finish(side)
+        side = 'O' if side == 'X' else 'X'
+
+    score = g.get_score('X')
+    return {
+        'x': spec_x,
+        'o': spec_o,
+        'size': [row, col],
+        'seed': seed,
+        'winner': 'X' if score > 0 else 'O' if score < 0 else 'draw',
+        'score': score,
+        'rewards': list(g.get_reward()),
+        'moves': moves,
+        'opening': opening,
+        'end': 'finished' if finished else 'blocked' if passes >= 2 else 'move_cap',
+        'illegal': illegal,
+        'think_ms': {s: [round(t, 3) for t in times] for s, times in think_ms.items()},
+    }
+
+
+def _play_task(task):
+    return play_match(*task)
+
+
+def schedule(specs, games, row, col, seed=0, max_moves=None, opening_plies=0):
+    """
+    Return the match tasks of a round robin: every ordered pair of different
+    specs plays games games, so each pair meets with both colours, except
+    the colours an agent cannot play (the other side of a Q-table)
+    """
+    tasks = []
+    for spec_x in specs:
+        for spec_o in specs:
+            if spec_x == spec_o:
+                continue
+            if 'X' not in get_agent(spec_x, row, col).sides or 'O' not in get_agent(spec_o, row, col).sides:
+                continue
+            for _ in range(games):
+                tasks.append((spec_x, spec_o, row, col, seed * 1000003 + len(tasks), max_moves, opening_plies))
+    return tasks
+
+
+def run_matches(tasks, workers=None, out=None, chunksize=None):
+    """
+    :param: tasks from schedule, workers, out (file for JSON lines), chunksize
+    :return: list of result dicts, games per second
+
+    Play the tasks in a process pool and write each result to out as soon
+    as it is in. Results come back in task order, so the output of a run
+    only depends on its seed, as long as no agent has a time budget.
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (workers * 8))
+    results = []
+    start = timeit.default_timer()
+    with ProcessPoolExecutor(workers) as executor:
+        for result in executor.map(_play_task, tasks, chunksize=chunksize):
+            results.append(result)
+            if out is not None:
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+    elapsed = timeit.default_timer() - start
+    return results, len(results) / elapsed if elapsed else 0.0
+
+
+def expected_score(rating, other):
+    """
+    Return the expected score of a player rated rating against other
+    """
+    return 1.0 / (1.0 + 10 ** ((other - rating) / 400.0))
+
+
+def elo_ratings(results, base=1500, iterations=2000, prior_games=1):
+    """
+    :param: results, base (mean rating), iterations, prior_games
+    :return: dict of spec to Elo rating
+
+    Fit ratings that best explain all the results at once (a Bradley-Terry
+    fit on the Elo scale, a draw counting half a win), so the order of the
+    games does not matter. Each agent also gets prior_games draws against
+    an average opponent, which keeps the ratings finite when an agent wins
+    or loses every game.
+    """
+    games = []
+    for result in results:
+        points = {'X': 1.0, 'O': 0.0, 'draw': 0.5}[result['winner']]
+        games.append((result['x'], result['o'], points))
+    specs = sorted({spec for game in games for spec in game[:2]})
+    ratings = {spec: 0.0 for spec in specs}
+    played = {spec: prior_games for spec in specs}
+    for spec_x, spec_o, _ in games:
+        played[spec_x] += 1
+        played[spec_o] += 1
+
+    # gradient ascent on the log-likelihood, scaled per agent
+    step = 400.0 / math.log(10)
+    for _ in range(iterations):
+        residual = {spec: prior_games * (0.5 - expected_score(ratings[spec], 0.0)) for spec in specs}
+        for spec_x, spec_o, points in games:
+            expected = expected_score(ratings[spec_x], ratings[spec_o])
+            residual[spec_x] += points - expected
+            residual[spec_o] -= points - expected
+        for spec in specs:
+            ratings[spec] += step * residual[spec] / played[spec]
+
+    mean = sum(ratings.values()) / len(ratings) if ratings else 0.0
+    return {spec: base + rating - mean for spec, rating in ratings.items()}
+
+
+def summarize(results, games_per_sec=0.0):
+    """
+    :param: results, games_per_sec
+    :return: summary dict with per-agent records, mean think time and Elo
+    """
+    ratings = elo_ratings(results)
+    agents = {}
+    for spec in ratings:
+        agents[spec] = {'games': 0, 'wins': 0, 'draws': 0, 'losses': 0, 'moves': 0, 'think_ms': 0.0,
+                        'illegal': 0, 'elo': round(ratings[spec], 1)}
+    for result in results:
+        for side, spec in (('X', result['x']), ('O', result['o'])):
+            record = agents[spec]
+            record['games'] += 1
+            if result['winner'] == 'draw':
+                record['draws'] += 1
+            elif result['winner'] == side:
+                record['wins'] += 1
+            else:
+                record['losses'] += 1
+            record['moves'] += len(result['think_ms'][side])
+            record['think_ms'] += sum(result['think_ms'][side])
+            record['illegal'] += result['illegal'][side]
+    for record in agents.values():
+        record['mean_think_ms'] = record['think_ms'] / record['moves'] if record['moves'] else 0.0
+        del record['think_ms']
+    return {'games': len(results), 'games_per_sec': games_per_sec, 'agents': agents}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('agents', nargs='+', help='agent specs, at least two')
+    parser.add_argument('--size', type=int, nargs=2, default=[6, 6], metavar=('ROWS', 'COLS'))
+    parser.add_argument('--games', type=int, default=10, help='games per pair of agents and colour')
+    parser.add_argument('--workers', type=int, help='processes (default: all CPUs)')
+    parser.add_argument('--max-moves', type=int, help='move cap per game (default 2 * rows * cols)')
+    parser.add_argument('--opening-plies', type=int, default=2, help='random moves at the start of each game')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write the games as JSON lines to this file instead of stdout')
+    args = parser.parse_args(argv)
+    if len(set(args.agents)) < 2:
+        parser.error('need at least two different agents')
+
+    row, col = args.size
+    for spec in args.agents:
+        # fail on a bad spec before starting any process
+        get_agent(spec, row, col)
+
+    tasks = schedule(args.agents, args.games, row, col, args.seed, args.max_moves, args.opening_plies)
+    if not tasks:
+        parser.error('no pair of agents can play each other')
+    if args.out:
+        with open(args.out, 'w') as out:
+            results, games_per_sec = run_matches(tasks, args.workers, out)
+    else:
+        results, games_per_sec = run_matches(tasks, args.workers, sys.stdout)
+
+    summary = summarize(results, games_per_sec)
+    print("{} games, {:.1f} games/sec".format(summary['games'], games_per_sec), file=sys.stderr)
+    for spec, record in sorted(summary['agents'].items(), key=lambda item: -item[1]['elo']):
+        print("{:>8.1f}  {}  +{} ={} -{}  {:.2f} ms/move".format(record['elo'], spec, record['wins'],
+                                                             record['draws'], record['losses'],
+                                                             record['mean_think_ms']), file=sys.stderr)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+class MoveOrderer:
+    """
+    Orders the moves of a search node so that the best ones are searched first.
+
+    Moves are tried in this order:
+        1. the hash move (best move stored in the transposition table)
+        2. captures and moves to the last rank, the ones make_move rewards
+        3. killer moves, quiet moves that caused a beta cutoff at the same ply
+        4. the remaining moves ranked by the history heuristic
+    With enabled=False moves keep their scan order, which is useful to
+    measure how much the ordering saves.
+    """
+
+    def __init__(self, enabled=True, num_killers=2):
+        self.enabled = enabled
+        self.num_killers = num_killers
+        self.killers = {}
+        self.history = {}
+
+    def gain(self, board, move, side):
+        """
+        Return how much the score changes in favour of side by making move:
+        5 for reaching the last rank plus 1 for a capture
+        """
+        (row, col), h_move = move
+        gain = 0
+        if row == (1 if side == 'X' else board.total_row - 2):
+            gain += 5
+        if board.is_capture(row, col, h_move, side):
+            gain += 1
+        return gain
+
+    def order(self, board, moves, side, ply, tt_move=None):
+        """
+        :param: board, moves, side, ply, tt_move
+        :return: list of moves in search order
+        """
+        if not self.enabled:
+            if tt_move in moves:
+                moves.remove(tt_move)
+                moves.insert(0, tt_move)
+            return moves
+
+        killers = self.killers.get(ply, ())
+        keys = []
+        for idx, move in enumerate(moves):
+            if move == tt_move:
+                key = (0, 0)
+            else:
+                gain = self.gain(board, move, side)
+                if gain:
+                    key = (1, -gain)
+                elif move in killers:
+                    key = (2, killers.index(move))
+                else:
+                    key = (3, -self.history.get((side, move), 0))
+            keys.append((key, idx))
+        keys.sort()
+        return [moves[idx] for _, idx in keys]
+
+    def record_cutoff(self, board, move, side, ply, depth):
+        """
+        Remember a move that caused a beta cutoff as a killer of its ply and
+        reward it in the history table. Captures and promotions are already
+        searched early so they are not recorded.
+        """
+        if not self.enabled or self.gain(board, move, side):
+            return
+        killers = self.killers.setdefault(ply, [])
+        if move in killers:
+            killers.remove(move)
+        killers.insert(0, move)
+        del killers[self.num_killers:]
+        self.history[(side, move)] = self.history.get((side, move), 0) + depth * depth
+
+    def clear(self):
+        """
+        Forget killers and history
+        """
+        self.killers = {}
+        self.history = {}
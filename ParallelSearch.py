@@ -0,0 +1,180 @@
+import os
+import timeit
+from concurrent.futures import ProcessPoolExecutor
+from Game import minimax, alpha_beta
+
+
+def _search_child(board, move, depth, maxTurn, alpha, beta, algo):
+    """
+    Worker task: make move on a copy of the board and search the resulting
+    position. Runs in a pool process, the board arrives pickled.
+    """
+    board.make_move(move[0][0], move[0][1], move[1])
+    if algo == 'minimax':
+        return minimax(board, depth, maxTurn)[1]
+    return alpha_beta(board, depth, maxTurn, alpha, beta)[1]
+
+
+def parallel_minimax(board, currDepth, maxTurn, workers=None, executor=None):
+    """
+    :param: board, currDepth, maxTurn, workers, executor
+    :return: best_move, best_score
+
+    Same as minimax but the subtrees of the root moves are searched in a
+    process pool. The scores are combined in move order, so the result is
+    the same as the serial search.
+    """
+    if currDepth == 0:
+        return minimax(board, currDepth, maxTurn)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(workers)
+    try:
+        moves = board.get_available_moves('O' if maxTurn else 'X')
+        futures = [executor.submit(_search_child, board, move, currDepth - 1, not maxTurn, None, None, 'minimax')
+                   for move in moves]
+        scores = [future.result() for future in futures]
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    best_move = ((0, 0), 0)
+    best_score = 0
+    for move, score in zip(moves, scores):
+        if maxTurn:
+            if score >= best_score:
+                best_score = score
+                best_move = move
+        else:
+            if score <= best_score:
+                best_score = score
+                best_move = move
+
+    return best_move, best_score
+
+
+def parallel_alpha_beta(board, currDepth, maxTurn, alpha=-1000, beta=1000, workers=None, ybw=False, executor=None):
+    """
+    :param: board, currDepth, maxTurn, alpha, beta, workers, ybw, executor
+    :return: best_move, value
+
+    Alpha-beta with the root moves split across a process pool (a new one of
+    workers processes unless an executor is given). Root moves are searched in
+    batches of one move per worker, all with the alpha-beta window
+    reached after the previous batch. With ybw (Young Brothers Wait) the first
+    move is searched on its own before the others, so they start with its bound.
+
+    Inside a batch the serial search would give later moves a narrower window.
+    A result is kept only when it is the same as with that window: when the
+    window did not change or the value lies strictly inside it. The other moves
+    are searched again in parallel with the serial window, which makes the
+    result identical to alpha_beta(board, currDepth, maxTurn, alpha, beta).
+    """
+    if currDepth == 0:
+        return alpha_beta(board, currDepth, maxTurn, alpha, beta)
+
+    if workers is None:
+        workers = os.cpu_count()
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(workers)
+
+    best_move = None
+    value = -1000 if maxTurn else 1000
+    moves = board.get_available_moves('O' if maxTurn else 'X')
+
+    try:
+        idx = 0
+        while idx < len(moves):
+            size = 1 if ybw and idx == 0 else workers
+            batch = moves[idx:idx + size]
+            idx += size
+
+            futures = [executor.submit(_search_child, board, move, currDepth - 1, not maxTurn, alpha, beta, 'alpha_beta')
+                       for move in batch]
+            scores = [future.result() for future in futures]
+
+            # replay the serial window of each move and find the scores to redo
+            a, b = alpha, beta
+            redo = {}
+            for i, score in enumerate(scores):
+                if (a, b) != (alpha, beta) and not a < score < b:
+                    redo[i] = (a, b)
+                    if (score >= b) if maxTurn else (score <= a):
+                        # the serial search cuts off at this move
+                        break
+                elif maxTurn:
+                    a = max(a, score)
+                else:
+                    b = min(b, score)
+                if b <= a:
+                    break
+            futures = {i: executor.submit(_search_child, board, batch[i], currDepth - 1, not maxTurn,
+                                          window[0], window[1], 'alpha_beta')
+                       for i, window in redo.items()}
+            for i, future in futures.items():
+                scores[i] = future.result()
+
+            for move, score in zip(batch, scores):
+                if maxTurn:
+                    if score > value or best_move is None:
+                        value = score
+                        best_move = move
+                        alpha = max(value, alpha)
+                        if beta <= alpha:
+                            return best_move, value
+                else:
+                    if score < value or best_move is None:
+                        value = score
+                        best_move = move
+                        beta = min(value, beta)
+                        if beta <= alpha:
+                            return best_move, value
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    return best_move or ((0, 0), 0), value
+
+
+def compare_parallel(board, depth, maxTurn=True, algo='alpha_beta', workers=None, ybw=False):
+    """
+    :param: board, depth, maxTurn, algo, workers, ybw
+    :return: dict with serial and parallel results, times and speedup
+
+    Run the serial and the parallel search on the same position and report
+    whether they agree and how much faster the parallel one is.
+    """
+    if workers is None:
+        workers = os.cpu_count()
+
+    start = timeit.default_timer()
+    if algo == 'minimax':
+        serial = minimax(board, depth, maxTurn)
+    else:
+        serial = alpha_beta(board, depth, maxTurn, -1000, 1000)
+    serial_time = timeit.default_timer() - start
+
+    with ProcessPoolExecutor(workers) as executor:
+        # start the worker processes before timing
+        list(executor.map(abs, range(workers)))
+        start = timeit.default_timer()
+        if algo == 'minimax':
+            parallel = parallel_minimax(board, depth, maxTurn, workers, executor)
+        else:
+            parallel = parallel_alpha_beta(board, depth, maxTurn, -1000, 1000, workers, ybw, executor)
+        parallel_time = timeit.default_timer() - start
+
+    return {
+        'algo': algo,
+        'depth': depth,
+        'workers': workers,
+        'ybw': ybw,
+        'serial': serial,
+        'parallel': parallel,
+        'identical': serial == parallel,
+        'serial_time': serial_time,
+        'parallel_time': parallel_time,
+        'speedup': serial_time / parallel_time if parallel_time else 0.0,
+    }
@@ -1,4 +1,11 @@
+import json
+import os
 import random
+from QTable import QTable, MappedQTable, ACTION_BITS, encode_state, encode_action, write_qtable
+from Symmetry import Mirror
+
+# traces smaller than this are dropped
+TRACE_CUTOFF = 0.01
 
 class Player():
     """A class that represents a player in the game"""
@@ -26,58 +33,163 @@ class Player():
         Set the coin type of a player
         """
         self.side = side
+
+    def end_episode(self):
+        """
+        Called when a game is over
+        """
+        pass
+
+
+class ReplayBuffer:
+    """
+    A fixed-capacity ring buffer of transitions (prev_state, action, reward,
+    result_state, actions). Once full, every new transition overwrites the
+    oldest one.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.transitions = []
+        self.next = 0
+
+    def add(self, transition):
+        if len(self.transitions) < self.capacity:
+            self.transitions.append(transition)
+        else:
+            self.transitions[self.next] = transition
+        self.next = (self.next + 1) % self.capacity
+
+    def sample(self, n):
+        """
+        Return n transitions drawn uniformly at random with replacement
+        """
+        transitions = self.transitions
+        return [transitions[random.randrange(len(transitions))] for _ in range(n)]
+
+    def __len__(self):
+        return len(self.transitions)
         
     
     
 class QLearningPlayer(Player):
     """A class that represents an AI using Q-learning algorithm"""
     
-    def __init__(self, side, epsilon=0.1, alpha=0.3, gamma=0.9):
+    def __init__(self, side, epsilon=0.1, alpha=0.3, gamma=0.9, trace_lambda=0.0, replay_size=0,
+                 replay_batch=32, replay_every=16, mirror=None):
         """
         Initialize a Q-learner with parameters epsilon, alpha and gamma
-        and its coin type
+        and its coin type. A trace_lambda above 0 turns on Watkins's Q(lambda)
+        eligibility traces, and a replay_size above 0 keeps that many past
+        transitions and replays replay_batch of them every replay_every moves.
+        With a Symmetry.Mirror of the board, a position and its mirror image
+        share their Q values. Exploration and ties draw from rng when it is
+        set to a random.Random, and from the random module otherwise.
         """
         Player.__init__(self, side)
-        self.q = {}
+        self.q = QTable()
         self.epsilon = epsilon # e-greedy chance of random exploration
         self.alpha = alpha # learning rate
         self.gamma = gamma # discount factor for future rewards 
+        self.trace_lambda = trace_lambda
+        self.traces = {}
+        self.explored = False
+        self.replay = ReplayBuffer(replay_size) if replay_size else None
+        self.replay_batch = replay_batch
+        self.replay_every = replay_every
+        self.steps = 0
+        self.mirror = mirror
+        self.rng = None
+        # sum of the absolute TD errors of the moves learned and their count
+        self.td_error_sum = 0.0
+        self.td_updates = 0
+        # move lists refilled by every complete_move
+        self.actions = []
+        self.result_actions = []
         
     def getQ(self, state, action):
         """
         Return a probability for a given state and action where the greater
         the probability the better the move
         """
-        # encourage exploration; "optimistic" 1.0 initial values
-        if self.q.get((state, action)) is None:
-            self.q[(state, action)] = 10
-        return self.q.get((state, action))  
+        # encourage exploration; "optimistic" initial values of 10 that
+        # are returned but not stored until the entry is learned
+        return self.q.get_key(self.key(state, action), 10)
+
+    def key(self, state, action):
+        """
+        Return the Q table key of a state and action, canonical with a mirror
+        """
+        code = encode_state(state)
+        if self.mirror is not None:
+            code, mirrored = self.mirror.canonical(code)
+            if mirrored:
+                action = self.mirror.action(action)
+        return (code << ACTION_BITS) | encode_action(action)
+
+    def action_values(self, state, actions):
+        """
+        Return the Q values of all actions of a state
+        """
+        code = encode_state(state)
+        if self.mirror is not None:
+            code, mirrored = self.mirror.canonical(code)
+            if mirrored:
+                actions = [self.mirror.action(a) for a in actions]
+        code <<= ACTION_BITS
+        get_key = self.q.get_key
+        return [get_key(code | encode_action(a), 10) for a in actions]
+
+    def code_values(self, state, actions, codes):
+        """
+        Same as action_values when the encode_action codes of the actions
+        are known, as BatchGame computes them for a whole batch at once
+        """
+        if self.mirror is not None:
+            return self.action_values(state, actions)
+        code = encode_state(state) << ACTION_BITS
+        return self.q.get_keys([code | action_code for action_code in codes], 10)
     
     def getWholeQ(self):  
         return self.q
         
-    def choose_action(self, state, actions):
+    def choose_action(self, state, actions, codes=None):
         """
         Return an action based on the best move recommendation by the current
-        Q-Table with a epsilon chance of trying out a new move
+        Q-Table with a epsilon chance of trying out a new move. codes are the
+        encode_action codes of the actions, if known.
         """
-        current_state = state
-        
-        if random.random() < self.epsilon: # explore!
-            chosen_action = random.choice(actions)
+        rng = self.rng or random
+        if rng.random() < self.epsilon: # explore!
+            chosen_action = rng.choice(actions)
+            self.explored = True
             return chosen_action
+        self.explored = False
 
-        qs = [self.getQ(current_state, a) for a in actions]
+        if codes is None:
+            qs = self.action_values(state, actions)
+        else:
+            qs = self.code_values(state, actions, codes)
         maxQ = max(qs)
 
         if qs.count(maxQ) > 1:
             # more than 1 best option; choose among them randomly
             best_options = [i for i in range(len(actions)) if qs[i] == maxQ]
-            i = random.choice(best_options)
+            i = rng.choice(best_options)
         else:
             i = qs.index(maxQ)
 
         return actions[i]
+
+    def choose_actions(self, states, actions_list, codes_list=None):
+        """
+        Batch form of choose_action: return one action per state, given the
+        action codes of every state in codes_list if they are known
+        """
+        if codes_list is None:
+            return [self.choose_action(state, actions) for state, actions in zip(states, actions_list)]
+        return [self.choose_action(state, actions, codes)
+                for state, actions, codes in zip(states, actions_list, codes_list)]
     
     def learn(self, game, actions, chosen_action):
         """
@@ -90,14 +202,106 @@ class QLearningPlayer(Player):
             reward = rewards[0]
         else:
             reward = rewards[1]
-        prev_state = game.get_prev_state()
-        prev = self.getQ(prev_state, chosen_action)
-        result_state = game.get_state()
-        if actions:
-            maxqnew = max([self.getQ(result_state, a) for a in actions])
+        self.update(game.get_prev_state_key(), chosen_action, reward, game.get_state_key(), actions)
+
+    def learn_batch(self, prev_states, chosen_actions, rewards, result_states, actions_list, codes_list=None):
+        """
+        Batch form of learn for games stepped together: one update per game
+        from its previous state, chosen action, reward, resulting state and
+        the actions available in the resulting state, whose action codes
+        codes_list may give. The updates are made one game after the other,
+        as the games may share Q entries. The games are interleaved, so
+        eligibility traces are not used here.
+        """
+        if codes_list is None:
+            codes_list = [None] * len(actions_list)
+        for prev_state, chosen_action, reward, result_state, actions, codes in zip(
+                prev_states, chosen_actions, rewards, result_states, actions_list, codes_list):
+            self.td_error_sum += abs(self.td_update(prev_state, chosen_action, reward, result_state, actions, codes))
+            self.td_updates += 1
+            self.remember((prev_state, chosen_action, reward, result_state, actions))
+
+    def td_error(self, prev_state, chosen_action, reward, result_state, actions, codes=None):
+        """
+        Return the difference between the reward plus the discounted best Q
+        value of result_state and the Q value of (prev_state, chosen_action)
+        """
+        if actions and codes is not None:
+            maxqnew = max(self.code_values(result_state, actions, codes))
+        elif actions:
+            maxqnew = max(self.action_values(result_state, actions))
         else:
             maxqnew = 0
-        self.q[(prev_state, chosen_action)] = prev + self.alpha * ((reward + self.gamma*maxqnew) - prev)    
+        return reward + self.gamma*maxqnew - self.getQ(prev_state, chosen_action)
+
+    def td_update(self, prev_state, chosen_action, reward, result_state, actions, codes=None):
+        """
+        One-step Q-learning update of (prev_state, chosen_action); return
+        the TD error
+        """
+        prev_state = encode_state(prev_state)
+        result_state = encode_state(result_state)
+        delta = self.td_error(prev_state, chosen_action, reward, result_state, actions, codes)
+        key = self.key(prev_state, chosen_action)
+        self.q.set_key(key, self.q.get_key(key, 10) + self.alpha * delta)
+        return delta
+
+    def update(self, prev_state, chosen_action, reward, result_state, actions):
+        """
+        Move the Q value of (prev_state, chosen_action) towards the reward
+        plus the discounted best Q value of result_state. With traces the
+        same error also updates the pairs visited earlier in the game.
+        """
+        prev_state = encode_state(prev_state)
+        result_state = encode_state(result_state)
+        if not self.trace_lambda:
+            delta = self.td_update(prev_state, chosen_action, reward, result_state, actions)
+        else:
+            delta = self.td_error(prev_state, chosen_action, reward, result_state, actions)
+            if self.explored:
+                # Watkins's Q(lambda): earlier pairs led to a non-greedy move
+                self.traces = {}
+            key = self.key(prev_state, chosen_action)
+            self.traces[key] = self.traces.get(key, 0.0) + 1.0
+            decay = self.gamma * self.trace_lambda
+            step = self.alpha * delta
+            traces = {}
+            for trace_key, trace in self.traces.items():
+                self.q.set_key(trace_key, self.q.get_key(trace_key, 10) + step * trace)
+                if trace * decay >= TRACE_CUTOFF:
+                    traces[trace_key] = trace * decay
+            self.traces = traces
+        self.td_error_sum += abs(delta)
+        self.td_updates += 1
+        self.remember((prev_state, chosen_action, reward, result_state, actions))
+
+    def remember(self, transition):
+        """
+        Store a transition in the replay buffer and replay a batch of stored
+        ones every replay_every moves
+        """
+        if self.replay is None:
+            return
+        # the actions may be a list that complete_move refills
+        self.replay.add(transition[:4] + (list(transition[4]),))
+        self.steps += 1
+        if self.steps % self.replay_every == 0:
+            for replayed in self.replay.sample(self.replay_batch):
+                self.td_update(*replayed)
+
+    def end_episode(self):
+        """
+        Forget the eligibility traces of the finished game
+        """
+        self.traces = {}
+        
+    def save(self, path, rows, cols):
+        """
+        Save the Q table and the learning parameters to a binary file that
+        load_player can map back without reading it all
+        """
+        write_qtable(path, self.q, rows, cols, self.side, self.epsilon, self.alpha, self.gamma,
+                     self.mirror is not None)
         
     def complete_move(self, game):
         """
@@ -105,13 +309,84 @@ class QLearningPlayer(Player):
         chosen move
         """
         game_over = False
-        actions = game.get_available_moves(self.side)
-        state = game.get_state()
+        actions = game.get_available_moves(self.side, self.actions)
         if actions:
-            chosen_action = self.choose_action(state, actions)
+            chosen_action = self.choose_action(game.get_state_key(), actions)
             game.make_move(chosen_action[0][0], chosen_action[0][1], chosen_action[1])
-            actions = game.get_available_moves(self.side)
+            actions = game.get_available_moves(self.side, self.result_actions)
             self.learn(game, actions, chosen_action)
         
         game_over = game.game_finish(self.side)
         return game_over
+
+
+def load_player(path, writable=False):
+    """
+    Return a QLearningPlayer with the Q table saved at path. The table is
+    memory-mapped and read-only unless writable is True, in which case it is
+    copied into a QTable so training can continue. The board size it was
+    trained on is in player.q.rows and player.q.cols for a mapped table.
+    """
+    table = MappedQTable(path)
+    player = QLearningPlayer(table.side, table.epsilon, table.alpha, table.gamma)
+    if table.mirrored:
+        player.mirror = Mirror(table.rows, table.cols)
+    if writable:
+        player.q = table.to_qtable()
+        table.close()
+    else:
+        player.q = table
+    return player
+
+
+def save_checkpoint(path, players, games, win_list, rows, cols):
+    """
+    Save the Q tables of both training players and the training progress.
+    The tables are written to new files named after path and the game
+    count, and only then is the small JSON file at path that names them
+    replaced, so a crash at any point leaves the previous checkpoint whole.
+    The tables of the previous checkpoint are removed afterwards.
+    """
+    files = {}
+    for player in players:
+        files[player.side] = '{}.{}.{}.bin'.format(path, games, player.side)
+        player.save(files[player.side], rows, cols)
+    old = read_checkpoint(path)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'games': games, 'win_list': win_list, 'rows': rows, 'cols': cols, 'files': files}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    if old is not None:
+        for name in old['files'].values():
+            if name not in files.values() and os.path.exists(name):
+                os.remove(name)
+
+
+def read_checkpoint(path):
+    """
+    Return the progress saved by save_checkpoint at path, or None
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_checkpoint(path, players, rows, cols):
+    """
+    Load the Q tables saved at path into the training players and return
+    the saved progress, or None when there is no checkpoint or it was made
+    on a board other than rows x cols
+    """
+    checkpoint = read_checkpoint(path)
+    if checkpoint is None or (checkpoint['rows'], checkpoint['cols']) != (rows, cols):
+        return None
+    for player in players:
+        loaded = load_player(checkpoint['files'][player.side], writable=True)
+        player.q = loaded.q
+        player.mirror = loaded.mirror
+    return checkpoint
@@ -0,0 +1,308 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+# an action ((row, col), h) packs into row << 12 | col << 2 | (h + 1)
+ACTION_BITS = 22
+
+# file header: magic, version, rows, cols, side, epsilon, alpha, gamma,
+# key width in bytes, flags and entry count; sorted keys and values follow
+_MAGIC = b'QTBL'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHHcxdddHBxxxxxQ')
+
+# flag set when the states of the keys are canonical mirror images (Symmetry.py)
+FLAG_MIRRORED = 1
+
+_X_BITS = str.maketrans('XO_', '100')
+_O_BITS = str.maketrans('XO_', '010')
+
+
+def encode_state(state):
+    """
+    Return the integer code of a state: the 'X' bitmask in the low bits and
+    the 'O' bitmask above it, bit row * cols + col for each square. States
+    from Game.get_state (tuples of tuples of 'O'/'X'/'_') and codes from
+    BitboardGame.get_state (already integers) give the same code.
+    """
+    if isinstance(state, int):
+        return state
+    cells = ''.join(map(''.join, state))
+    x = int(cells.translate(_X_BITS)[::-1], 2)
+    o = int(cells.translate(_O_BITS)[::-1], 2)
+    return x | (o << len(cells))
+
+
+def encode_action(action):
+    """
+    Return the small integer code of an action ((row, col), horizontal_move)
+    """
+    (row, col), h_move = action
+    return (row << 12) | (col << 2) | (h_move + 1)
+
+
+def decode_action(code):
+    """
+    Return the action ((row, col), horizontal_move) of an action code
+    """
+    return ((code >> 12, (code >> 2) & 0x3FF), (code & 3) - 1)
+
+
+def encode_key(state, action):
+    """
+    Return the integer key of a (state, action) pair
+    """
+    return (encode_state(state) << ACTION_BITS) | encode_action(action)
+
+
+class QTable:
+    """
+    A compact Q-table: each (state, action) pair is packed into one integer
+    key that maps to a slot of a typed array of values. Reading a missing
+    entry returns the default and does not insert anything. Every set also
+    counts a visit of the entry, which is used to weight merged tables.
+
+    The index from keys to slots is a dict of Python ints, and it takes most
+    of the memory (about 85 to 120 of the 100 to 140 bytes of an entry on
+    4x4 to 6x6 boards); MappedQTable is the compact form of a saved table.
+    """
+
+    def __init__(self):
+        self.slots = {}
+        self.values = array('d')
+        self.visits = array('L')
+
+    def get(self, state, action, default=None):
+        """
+        Return the Q value of (state, action) or default if it was never set
+        """
+        slot = self.slots.get(encode_key(state, action))
+        if slot is None:
+            return default
+        return self.values[slot]
+
+    def set(self, state, action, value):
+        """
+        Set the Q value of (state, action)
+        """
+        self.set_key(encode_key(state, action), value)
+
+    def get_key(self, key, default=None):
+        """
+        Same as get for a key made by encode_key
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            return default
+        return self.values[slot]
+
+    def get_keys(self, keys, default=None):
+        """
+        Same as get_key for a list of keys, returning a list of values
+        """
+        values = self.values
+        return [default if slot is None else values[slot] for slot in map(self.slots.get, keys)]
+
+    def set_key(self, key, value, visits=1):
+        """
+        Same as set for a key made by encode_key, adding visits to the
+        visit count of the entry
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            self.slots[key] = len(self.values)
+            self.values.append(value)
+            self.visits.append(visits)
+        else:
+            self.values[slot] = value
+            self.visits[slot] += visits
+
+    def get_visits(self, key):
+        """
+        Return how many times the entry of key was set since the last
+        reset_visits
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            return 0
+        return self.visits[slot]
+
+    def reset_visits(self):
+        """
+        Set all visit counts to zero
+        """
+        self.visits = array('L', bytes(self.visits.itemsize * len(self.visits)))
+
+    def items(self):
+        """
+        Iterate over (key, value) pairs
+        """
+        values = self.values
+        for key, slot in self.slots.items():
+            yield key, values[slot]
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, pair):
+        return encode_key(*pair) in self.slots
+
+    def memory_usage(self):
+        """
+        Return the number of bytes used by the index, the keys and the values
+        """
+        size = sys.getsizeof(self.slots) + sys.getsizeof(self.values) + sys.getsizeof(self.visits)
+        for key, slot in self.slots.items():
+            size += sys.getsizeof(key) + sys.getsizeof(slot)
+        return size
+
+    def stats(self):
+        """
+        Return the entry count and memory usage as a dict
+        """
+        entries = len(self)
+        memory = self.memory_usage()
+        return {
+            'entries': entries,
+            'memory_bytes': memory,
+            'bytes_per_entry': memory / entries if entries else 0.0,
+        }
+
+
+def write_qtable(path, table, rows, cols, side, epsilon, alpha, gamma, mirrored=False):
+    """
+    Save a QTable to path in the binary format read by MappedQTable. The file
+    is written next to path and renamed over it, so readers never see a
+    partly written table. mirrored records that the table is keyed by
+    canonical states.
+    """
+    keys = sorted(table.slots)
+    width = max(1, (keys[-1].bit_length() + 7) // 8) if keys else 1
+    values = array('d', (table.values[table.slots[key]] for key in keys))
+    if sys.byteorder != 'little':
+        values.byteswap()
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, rows, cols, side.encode(), epsilon, alpha, gamma,
+                             width, FLAG_MIRRORED if mirrored else 0, len(keys)))
+        f.write(b''.join(key.to_bytes(width, 'big') for key in keys))
+        f.write(values.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class MappedQTable:
+    """
+    A read-only QTable backed by a file written by write_qtable. The file is
+    memory-mapped and lookups binary-search the sorted keys in place, so
+    opening it takes no time and processes reading the same file share it.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.rows, self.cols, side, self.epsilon, self.alpha, self.gamma,
+         self.width, flags, self.count) = _HEADER.unpack_from(self.mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("{} is not a Q-table file".format(path))
+        self.side = side.decode()
+        self.mirrored = bool(flags & FLAG_MIRRORED)
+        self.keys_offset = _HEADER.size
+        self.values_offset = self.keys_offset + self.width * self.count
+
+    def _find(self, key):
+        """
+        Return the index of key in the file or -1
+        """
+        if key.bit_length() > self.width * 8:
+            return -1
+        target = key.to_bytes(self.width, 'big')
+        mm = self.mm
+        width = self.width
+        base = self.keys_offset
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = base + mid * width
+            if mm[offset:offset + width] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and mm[base + lo * width:base + (lo + 1) * width] == target:
+            return lo
+        return -1
+
+    def get(self, state, action, default=None):
+        """
+        Return the Q value of (state, action) or default if it is not stored
+        """
+        return self.get_key(encode_key(state, action), default)
+
+    def get_key(self, key, default=None):
+        """
+        Same as get for a key made by encode_key
+        """
+        idx = self._find(key)
+        if idx < 0:
+            return default
+        return struct.unpack_from('<d', self.mm, self.values_offset + 8 * idx)[0]
+
+    def get_keys(self, keys, default=None):
+        """
+        Same as get_key for a list of keys, returning a list of values
+        """
+        return [self.get_key(key, default) for key in keys]
+
+    def set(self, state, action, value):
+        raise TypeError("a mapped Q-table is read-only, use to_qtable() to train it")
+
+    def set_key(self, key, value):
+        raise TypeError("a mapped Q-table is read-only, use to_qtable() to train it")
+
+    def items(self):
+        """
+        Iterate over (key, value) pairs in key order
+        """
+        width = self.width
+        for idx in range(self.count):
+            offset = self.keys_offset + idx * width
+            key = int.from_bytes(self.mm[offset:offset + width], 'big')
+            yield key, struct.unpack_from('<d', self.mm, self.values_offset + 8 * idx)[0]
+
+    def to_qtable(self):
+        """
+        Return a writable QTable with the same entries and no visits
+        """
+        table = QTable()
+        for key, value in self.items():
+            table.set_key(key, value, 0)
+        return table
+
+    def close(self):
+        self.mm.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, pair):
+        return self._find(encode_key(*pair)) >= 0
+
+    def memory_usage(self):
+        """
+        Return the size of the mapped file in bytes
+        """
+        return len(self.mm)
+
+    def stats(self):
+        """
+        Return the entry count and memory usage as a dict
+        """
+        return {
+            'entries': self.count,
+            'memory_bytes': self.memory_usage(),
+            'bytes_per_entry': self.memory_usage() / self.count if self.count else 0.0,
+        }
@@ -0,0 +1,140 @@
+import json
+import timeit
+
+
+def percentile(values, pct):
+    """
+    Return the pct percentile of values by nearest rank
+    """
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class SearchStats:
+    """
+    Counters and timings collected by minimax, alpha_beta and cuttingoff_search
+    when one is passed as their stats argument. Searches run without stats
+    skip all of this.
+
+    Per ply it counts the nodes visited, the leaf evaluations, the beta cutoffs
+    and the time spent in the nodes of that ply (including their subtrees).
+    cutoff_index counts at which move index the cutoffs happened, so index 0
+    means the first move searched was good enough. copies counts the board
+    copies of play, play_training_game and MCTS when they are given the
+    stats; the searches themselves make and undo moves in place.
+    Nodes up to trace_plies deep are also recorded as Chrome trace events.
+    """
+
+    def __init__(self, trace_plies=2):
+        self.trace_plies = trace_plies
+        self.nodes = []
+        self.leaves = []
+        self.cutoffs = []
+        self.seconds = []
+        self.cutoff_index = {}
+        self.copies = 0
+        self.events = []
+        self.origin = timeit.default_timer()
+
+    def _grow(self, ply):
+        while len(self.nodes) <= ply:
+            self.nodes.append(0)
+            self.leaves.append(0)
+            self.cutoffs.append(0)
+            self.seconds.append(0.0)
+
+    def node(self, ply):
+        """
+        Count a node visited at ply
+        """
+        if ply >= len(self.nodes):
+            self._grow(ply)
+        self.nodes[ply] += 1
+
+    def leaf(self, ply):
+        """
+        Count a leaf evaluation at ply
+        """
+        if ply >= len(self.leaves):
+            self._grow(ply)
+        self.leaves[ply] += 1
+
+    def cutoff(self, ply, index):
+        """
+        Count a beta cutoff at ply by the move searched at position index
+        """
+        self.cutoffs[ply] += 1
+        self.cutoff_index[index] = self.cutoff_index.get(index, 0) + 1
+
+    def copy(self):
+        """
+        Count a board copy
+        """
+        self.copies += 1
+
+    def enter(self):
+        """
+        Return the start time of a node
+        """
+        return timeit.default_timer()
+
+    def leave(self, ply, start, move=None):
+        """
+        Add the time since start to ply and trace the node if it is shallow enough
+        """
+        stop = timeit.default_timer()
+        if ply >= len(self.seconds):
+            self._grow(ply)
+        self.seconds[ply] += stop - start
+        if ply <= self.trace_plies:
+            self.events.append({
+                'name': 'root' if move is None else str(move),
+                'cat': 'search',
+                'ph': 'X',
+                'ts': (start - self.origin) * 1e6,
+                'dur': (stop - start) * 1e6,
+                'pid': 1,
+                'tid': 1,
+                'args': {'ply': ply},
+            })
+
+    def measure(self, search, *args, **kwargs):
+        """
+        Run search(*args, **kwargs) with these stats and time it as ply 0
+        """
+        kwargs['stats'] = self
+        start = self.enter()
+        result = search(*args, **kwargs)
+        self.leave(0, start)
+        return result
+
+    def total_nodes(self):
+        return sum(self.nodes)
+
+    def to_dict(self):
+        """
+        Return all counters as a dict
+        """
+        cutoffs = sum(self.cutoffs)
+        return {
+            'nodes': self.total_nodes(),
+            'nodes_per_ply': list(self.nodes),
+            'leaves': sum(self.leaves),
+            'leaves_per_ply': list(self.leaves),
+            'cutoffs': cutoffs,
+            'cutoffs_per_ply': list(self.cutoffs),
+            'cutoff_index': dict(sorted(self.cutoff_index.items())),
+            'first_move_cutoff_rate': self.cutoff_index.get(0, 0) / cutoffs if cutoffs else 0.0,
+            'copies': self.copies,
+            'seconds_per_ply': list(self.seconds),
+        }
+
+    def write_chrome_trace(self, path):
+        """
+        Write the traced nodes in the Chrome trace event format, which
+        chrome://tracing and Perfetto open as a flame chart
+        """
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms',
+                       'otherData': self.to_dict()}, f)
@@ -0,0 +1,219 @@
+"""
+Exact solver for small boards, and validation of the agents against it.
+
+    python3 Solver.py 4 4
+    python3 Solver.py 4 4 --validate alpha_beta:4 cuttingoff:4 mcts:2000 --positions 50
+
+A position is solved by searching every line to the end of the game, not to
+a fixed depth: its value is the score 'O' still gains under best play from
+both sides, by the move_values and solve_position of Tablebase.py (a side
+without a legal move passes and the game ends when neither side can move),
+so the two always agree. Values are memoized
+per canonical position and side to move in a cache of bounded size that
+evicts the least recently used entries, so positions reached by different
+move orders, or mirrored, are solved once while they stay in the cache.
+
+--validate plays each agent (given as in MatchRunner) on random positions
+and compares the exact value of the move it picks with the best one.
+"""
+import argparse
+import random
+import sys
+import timeit
+from collections import OrderedDict
+from BitboardGame import BitboardGame
+from Symmetry import Mirror
+from Tablebase import NO_MOVE, move_values, solve_position
+
+
+class Solver:
+    """
+    Memoized exact minimax. capacity bounds the number of cached positions;
+    with symmetry a position and its mirror image share one entry.
+    """
+
+    def __init__(self, capacity=1 << 20, symmetry=True):
+        self.capacity = capacity
+        self.symmetry = symmetry
+        self.cache = OrderedDict()
+        self.mirror = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.solved = 0
+
+    def _key(self, board, maxTurn):
+        code = board.get_state_key()
+        if self.symmetry:
+            if self.mirror is None or (self.mirror.rows, self.mirror.cols) != (board.total_row, board.total_col):
+                self.mirror = Mirror(board.total_row, board.total_col)
+            code = self.mirror.canonical(code)[0]
+        return (code << 1) | maxTurn
+
+    def value(self, board, maxTurn):
+        """
+        :param: board, maxTurn ('O' to move)
+        :return: the exact score 'O' still gains from board
+        """
+        key = self._key(board, maxTurn)
+        cache = self.cache
+        value = cache.get(key)
+        if value is not None:
+            self.hits += 1
+            cache.move_to_end(key)
+            return value
+        self.misses += 1
+
+        value = solve_position(board, 'O' if maxTurn else 'X', self._value_of(board))[0]
+        self.solved += 1
+        cache[key] = value
+        if len(cache) > self.capacity:
+            cache.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def move_values(self, board, maxTurn, moves=None):
+        """
+        Return the exact value (score 'O' still gains) of each move of the
+        side to move, in get_available_moves order
+        """
+        side = 'O' if maxTurn else 'X'
+        if moves is None:
+            moves = board.get_available_moves(side)
+        return move_values(board, side, moves, self._value_of(board))
+
+    def _value_of(self, board):
+        return lambda side: self.value(board, side == 'O')
+
+    def solve(self, board, maxTurn):
+        """
+        :param: board, maxTurn
+        :return: best move (None when the side to move has to pass), exact final score for 'O'
+
+        Like the searches, the value includes the score of board so far.
+        """
+        side = 'O' if maxTurn else 'X'
+        value, move_idx = solve_position(board, side, self._value_of(board))
+        move = None if move_idx == NO_MOVE else board.get_available_moves(side)[move_idx]
+        return move, board.get_score('O') + value
+
+    def stats(self):
+        """
+        Return the cached and solved position counts and the cache hit rate
+        """
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.cache),
+            'capacity': self.capacity,
+            'solved': self.solved,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+def random_positions(row, col, count, seed):
+    """
+    Return count (moves, maxTurn) pairs: the moves of seeded random play
+    from the start and whether 'O' is to move after them. The side to move
+    always has a legal move.
+    """
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        board = BitboardGame(row, col)
+        side = 'X'
+        played = []
+        for _ in range(rng.randint(0, row * col // 2)):
+            moves = board.get_available_moves(side)
+            if not moves:
+                break
+            move = rng.choice(moves)
+            undo = board.make_move(move[0][0], move[0][1], move[1])
+            if board.game_finish(side):
+                board.undo_move(undo)
+                break
+            played.append(move)
+            side = 'O' if side == 'X' else 'X'
+        if board.get_available_moves(side):
+            positions.append((played, side == 'O'))
+    return positions
+
+
+def build_board(cls, row, col, moves):
+    """
+    Return a board of class cls after playing moves from the start position
+    """
+    board = cls(row, col)
+    for move in moves:
+        board.make_move(move[0][0], move[0][1], move[1])
+    return board
+
+
+def validate(solver, specs, row, col, positions=50, seed=0):
+    """
+    :param: solver, specs (agent specs as in MatchRunner), row, col, positions, seed
+    :return: list of dicts, one per spec
+
+    For every spec count the positions where the agent picks a move of the
+    best exact value, and the mean value it gives away when it does not.
+    Each agent starts every position from its own random generator seeded
+    with seed and the position number, so the global random state is left
+    alone.
+    """
+    from Game import Game
+    from MatchRunner import get_agent
+
+    cases = []
+    for played, maxTurn in random_positions(row, col, positions, seed):
+        board = build_board(BitboardGame, row, col, played)
+        values = solver.move_values(board, maxTurn)
+        best = max(values) if maxTurn else min(values)
+        cases.append((played, maxTurn, board.get_available_moves('O' if maxTurn else 'X'), values, best))
+
+    results = []
+    for spec in specs:
+        agent = get_agent(spec, row, col)
+        optimal = 0
+        loss = 0
+        for index, (played, maxTurn, moves, values, best) in enumerate(cases):
+            game = build_board(Game, row, col, played)
+            agent.new_game(seed * 1000003 + index)
+            move = agent.choose_move(game, 'O' if maxTurn else 'X')
+            value = values[moves.index(move)] if move in moves else (min(values) if maxTurn else max(values))
+            if value == best:
+                optimal += 1
+            loss += abs(best - value)
+        results.append({'agent': spec, 'positions': len(cases), 'optimal': optimal / len(cases),
+                        'mean_loss': loss / len(cases)})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('rows', type=int)
+    parser.add_argument('cols', type=int)
+    parser.add_argument('--capacity', type=int, default=1 << 20, help='cached positions (default 1048576)')
+    parser.add_argument('--no-symmetry', action='store_true', help='do not share mirrored positions')
+    parser.add_argument('--validate', nargs='+', metavar='AGENT', help='agents to check against the solver')
+    parser.add_argument('--positions', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * args.rows * args.cols * args.cols + 100))
+    solver = Solver(args.capacity, not args.no_symmetry)
+    start = timeit.default_timer()
+    move, value = solver.solve(BitboardGame(args.rows, args.cols), False)
+    print("Start position: best move for 'X' {}, value for 'O' {} ({:.1f}s)".format(
+        move, value, timeit.default_timer() - start))
+    print(solver.stats())
+
+    if args.validate:
+        for result in validate(solver, args.validate, args.rows, args.cols, args.positions, args.seed):
+            print("{agent:<20} optimal {optimal:.0%}  mean loss {mean_loss:.2f}  ({positions} positions)".format(
+                **result))
+
+
+if __name__ == "__main__":
+    main()
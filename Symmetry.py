@@ -0,0 +1,111 @@
+"""
+Left-right mirror symmetry of the board.
+
+Mirroring a position swaps column c with column cols - 1 - c on every row;
+the mirrored position has the same value and its moves are the mirrored
+moves, a left step becoming a right step. A state and its mirror image are
+stored once under their canonical form, the smaller of the two state codes,
+and actions are mirrored on the way in and back on the way out.
+
+The transposition tables get the same effect from paired Zobrist keys: the
+high 64 bits of each key are the key of the mirrored square, so board.hash
+carries the hash of the mirror image at no extra cost in make_move.
+"""
+from TranspositionTable import zobrist_keys, SIDE_KEY
+
+_MASK64 = (1 << 64) - 1
+
+_paired_cache = {}
+_reverse_cache = {}
+
+
+def mirror_action(action, cols):
+    """
+    Return the action ((row, col), horizontal_move) on the mirrored board
+    """
+    (row, col), h_move = action
+    return (row, cols - 1 - col), -h_move
+
+
+def paired_zobrist_keys(row, col):
+    """
+    Return zobrist_keys(row, col) with the key of the mirrored square in the
+    high 64 bits of every key
+    """
+    keys = _paired_cache.get((row, col))
+    if keys is None:
+        plain = zobrist_keys(row, col)
+        keys = {}
+        for side, side_keys in plain.items():
+            keys[side] = [side_keys[i] | (side_keys[i - c + col - 1 - c] << 64)
+                          for i, c in ((i, i % col) for i in range(row * col))]
+        _paired_cache[(row, col)] = keys
+    return keys
+
+
+def tt_key(board, maxTurn):
+    """
+    :param: board (hashed with paired_zobrist_keys), maxTurn
+    :return: transposition table key of the canonical position, whether it is the mirror image
+
+    A move stored under a mirrored key has to be mirrored with mirror_action
+    when it is stored and when it is read back.
+    """
+    key = board.hash & _MASK64
+    mirror = board.hash >> 64
+    mirrored = mirror < key
+    if mirrored:
+        key = mirror
+    return (key ^ SIDE_KEY if maxTurn else key), mirrored
+
+
+class Mirror:
+    """
+    Canonicalizes the state codes of encode_state for a rows x cols board.
+    Both halves of a code, the 'X' and the 'O' bitmask, are made of rows of
+    cols bits, so mirroring reverses each of the 2 * rows rows of the code.
+    """
+
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.row_mask = (1 << cols) - 1
+        self.reverse = _reverse_cache.get(cols)
+        if self.reverse is None and cols <= 12:
+            width = '0{}b'.format(cols)
+            self.reverse = _reverse_cache[cols] = [int(format(bits, width)[::-1], 2) for bits in range(1 << cols)]
+
+    def mirror(self, code):
+        """
+        Return the state code of the mirror image of code
+        """
+        cols = self.cols
+        mirrored = 0
+        shift = 0
+        if self.reverse is not None:
+            reverse = self.reverse
+            for _ in range(2 * self.rows):
+                mirrored |= reverse[(code >> shift) & self.row_mask] << shift
+                shift += cols
+        else:
+            width = '0{}b'.format(cols)
+            for _ in range(2 * self.rows):
+                mirrored |= int(format((code >> shift) & self.row_mask, width)[::-1], 2) << shift
+                shift += cols
+        return mirrored
+
+    def canonical(self, code):
+        """
+        :param: state code
+        :return: canonical code, whether it is the mirror image of code
+        """
+        mirrored = self.mirror(code)
+        if mirrored < code:
+            return mirrored, True
+        return code, False
+
+    def action(self, action):
+        """
+        Return action mirrored to or from the canonical board
+        """
+        return mirror_action(action, self.cols)
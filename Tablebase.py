@@ -0,0 +1,243 @@
+"""
+Exact tablebases of small boards.
+
+    python3 Tablebase.py 5 5 --out tablebase_5x5.tb
+
+Every position reachable from the start is solved exactly: its value is the
+score 'O' gains from there until the end of the game under best play from
+both sides, the same get_score('O') scoring the searches use. The game ends
+when the side that moved finishes it (game_finish) or when neither side can
+move; a side without a legal move passes. The positions are written to an
+open-addressing hash table that Tablebase maps from the file and probes in
+place.
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import timeit
+from BitboardGame import BitboardGame
+
+# file header: magic, version, rows, cols, key width in bytes, log2 of the
+# slot count and entry count; the slots follow, each a big-endian key
+# (state << 1 | 'O' to move, 0 for an empty slot), a signed value byte and
+# the index of the best move in get_available_moves order
+_MAGIC = b'TBAS'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHHHHxxQ')
+_MULTIPLIER = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+
+# move index of a position whose side to move has to pass
+NO_MOVE = 255
+
+
+def _slot(key, bits):
+    """
+    Return the home slot of key in a table of 2 ** bits slots
+    """
+    return ((key * _MULTIPLIER) & _MASK64) >> (64 - bits)
+
+
+def move_values(board, side, moves, value):
+    """
+    :param: board, side to move, moves of side, value
+    :return: list of the exact value of each move
+
+    The value of a move is the score 'O' gains by it plus, unless it
+    finishes the game, value(other side) of the position it leads to;
+    value(side) returns the exact value of board with side to move.
+    """
+    other = 'O' if side == 'X' else 'X'
+    values = []
+    for move in moves:
+        before = board.get_score('O')
+        undo = board.make_move(move[0][0], move[0][1], move[1])
+        try:
+            result = board.get_score('O') - before
+            if not board.game_finish(side):
+                result += value(other)
+        finally:
+            board.undo_move(undo)
+        values.append(result)
+    return values
+
+
+def solve_position(board, side, value):
+    """
+    :param: board, side to move, value (as for move_values)
+    :return: exact score 'O' still gains from board, index of the best move
+
+    A side without a legal move passes (the index is NO_MOVE) and the game
+    ends when neither side can move. Ties go to the first best move.
+    """
+    moves = board.get_available_moves(side)
+    if not moves:
+        other = 'O' if side == 'X' else 'X'
+        return (value(other) if board.get_available_moves(other) else 0), NO_MOVE
+    values = move_values(board, side, moves, value)
+    best = max(values) if side == 'O' else min(values)
+    return best, values.index(best)
+
+
+def solve(row, col):
+    """
+    :param: row, col
+    :return: dict of key to (value, best move index)
+
+    Walk every position reachable from the start position depth first and
+    solve it after all of its children (postorder), memoizing each position
+    so it is solved once however many move orders reach it.
+    """
+    board = BitboardGame(row, col)
+    table = {}
+
+    def value(side):
+        key = (board.get_state() << 1) | (side == 'O')
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = solve_position(board, side, value)
+        return entry[0]
+
+    value('X')
+    return table
+
+
+def write_tablebase(path, table, rows, cols):
+    """
+    Write a table made by solve to path in the format read by Tablebase. The
+    file is written next to path and renamed over it.
+    """
+    width = max(1, (max(table).bit_length() + 7) // 8) if table else 1
+    bits = max(1, (2 * len(table) - 1).bit_length())
+    slot_size = width + 2
+    data = bytearray(slot_size << bits)
+    empty = bytes(width)
+    mask = (1 << bits) - 1
+    for key, (value, move_idx) in table.items():
+        slot = _slot(key, bits)
+        while data[slot * slot_size:slot * slot_size + width] != empty:
+            slot = (slot + 1) & mask
+        offset = slot * slot_size
+        data[offset:offset + width] = key.to_bytes(width, 'big')
+        struct.pack_into('<bB', data, offset + width, value, move_idx)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, rows, cols, width, bits, len(table)))
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Tablebase:
+    """
+    A tablebase file mapped into memory. probe hashes the position to its
+    slot and compares keys in place, so a lookup reads one or two slots
+    whatever the size of the file.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.rows, self.cols, self.width, self.bits, self.count = _HEADER.unpack_from(self.mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("{} is not a tablebase file".format(path))
+        self.mask = (1 << self.bits) - 1
+        self.slot_size = self.width + 2
+        self.empty = bytes(self.width)
+        self.hits = 0
+        self.misses = 0
+
+    def _find(self, key):
+        """
+        Return the file offset of the slot of key or -1
+        """
+        if key.bit_length() > self.width * 8:
+            return -1
+        target = key.to_bytes(self.width, 'big')
+        mm = self.mm
+        width = self.width
+        slot = _slot(key, self.bits)
+        while True:
+            offset = _HEADER.size + slot * self.slot_size
+            stored = mm[offset:offset + width]
+            if stored == target:
+                return offset
+            if stored == self.empty:
+                return -1
+            slot = (slot + 1) & self.mask
+
+    def probe(self, board, maxTurn):
+        """
+        :param: board, maxTurn ('O' to move)
+        :return: the exact score 'O' still gains from board, or None
+
+        A game the side that just moved has finished gains nothing more; the
+        table has no entry for it, but its value is known to be 0. Other
+        positions that are not in the table (other board sizes) return None.
+        """
+        if board.game_finish('X' if maxTurn else 'O'):
+            self.hits += 1
+            return 0
+        offset = self._find((board.get_state_key() << 1) | maxTurn)
+        if offset < 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return struct.unpack_from('<b', self.mm, offset + self.width)[0]
+
+    def best_move(self, board, maxTurn):
+        """
+        Return the best move of board from the table, or None
+        """
+        offset = self._find((board.get_state_key() << 1) | maxTurn)
+        if offset < 0:
+            return None
+        move_idx = self.mm[offset + self.width + 1]
+        if move_idx == NO_MOVE:
+            return None
+        return board.get_available_moves('O' if maxTurn else 'X')[move_idx]
+
+    def close(self):
+        self.mm.close()
+
+    def __len__(self):
+        return self.count
+
+    def stats(self):
+        """
+        Return the entry count, file size and probe hit rate as a dict
+        """
+        probes = self.hits + self.misses
+        return {
+            'entries': self.count,
+            'file_bytes': len(self.mm),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / probes if probes else 0.0,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('rows', type=int)
+    parser.add_argument('cols', type=int)
+    parser.add_argument('--out', help='tablebase file (default tablebase_<rows>x<cols>.tb)')
+    args = parser.parse_args(argv)
+
+    path = args.out or 'tablebase_{}x{}.tb'.format(args.rows, args.cols)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * args.rows * args.cols * args.cols + 100))
+    start = timeit.default_timer()
+    table = solve(args.rows, args.cols)
+    solved = timeit.default_timer()
+    write_tablebase(path, table, args.rows, args.cols)
+    print("{} positions solved in {:.1f}s, written to {} in {:.1f}s ({} bytes)".format(
+        len(table), solved - start, path, timeit.default_timer() - solved, os.path.getsize(path)))
+    print("Value of the start position for 'O': {}".format(table[(BitboardGame(args.rows, args.cols).get_state() << 1)][0]))
+
+
+if __name__ == "__main__":
+    main()
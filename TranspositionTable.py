@@ -0,0 +1,142 @@
+import random
+
+# bound types stored with each value
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# values at or beyond this are the +-1000 "no move" sentinels of the searches
+# and do not depend on the score of the position
+WIN_VALUE = 1000
+
+# hashed into the key when 'O' (the max player) is to move
+SIDE_KEY = 0x9E3779B97F4A7C15
+
+_zobrist_cache = {}
+
+
+def zobrist_keys(row, col):
+    """
+    Return the Zobrist keys of a row x col board as a dict mapping
+    'X' and 'O' to a list of 64 bit keys indexed by row * col + col.
+    The keys are seeded by the board size so every process gets the same ones.
+    """
+    keys = _zobrist_cache.get((row, col))
+    if keys is None:
+        rng = random.Random(row * 1000 + col)
+        keys = {side: [rng.getrandbits(64) for _ in range(row * col)] for side in ('X', 'O')}
+        _zobrist_cache[(row, col)] = keys
+    return keys
+
+
+class TranspositionTable:
+    """
+    A fixed size hash table of search results keyed by Zobrist hash.
+
+    Each entry holds (key, depth, value, bound, best_move). Values are stored
+    relative to the score of the position so they can be reused when the same
+    board is reached with a different score. The policy decides which entry
+    is evicted when two positions share a slot:
+        'depth'  -- keep the entry searched to the greater depth
+        'always' -- always replace with the newest entry
+        'two_tier' -- one depth-preferred and one always-replace slot per bucket
+    """
+
+    def __init__(self, size=1 << 16, policy='two_tier'):
+        if size & (size - 1):
+            raise ValueError("size must be a power of two")
+        if policy not in ('depth', 'always', 'two_tier'):
+            raise ValueError("unknown policy {}".format(policy))
+        self.size = size
+        self.mask = size - 1
+        self.policy = policy
+        self.depth_slots = [None] * size if policy != 'always' else None
+        self.always_slots = [None] * size if policy != 'depth' else None
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+        self.replacements = 0
+
+    def probe(self, key, score=0):
+        """
+        Look up a position
+        :param: key, score of the position
+        :return: (depth, value, bound, best_move) or None
+        """
+        idx = key & self.mask
+        occupied = False
+        for slots in (self.depth_slots, self.always_slots):
+            if slots is None:
+                continue
+            entry = slots[idx]
+            if entry is None:
+                continue
+            if entry[0] == key:
+                self.hits += 1
+                value = entry[2]
+                if -WIN_VALUE < value < WIN_VALUE:
+                    value += score
+                return entry[1], value, entry[3], entry[4]
+            occupied = True
+        self.misses += 1
+        if occupied:
+            self.collisions += 1
+        return None
+
+    def store(self, key, depth, value, bound, best_move, score=0):
+        """
+        Save a search result, evicting according to the policy
+        :param: key, depth, value, bound, best_move, score of the position
+        :return: None
+        """
+        if -WIN_VALUE < value < WIN_VALUE:
+            value -= score
+        entry = (key, depth, value, bound, best_move)
+        idx = key & self.mask
+        self.stores += 1
+
+        if self.depth_slots is not None:
+            old = self.depth_slots[idx]
+            if old is None or old[0] == key or depth >= old[1]:
+                if old is not None and old[0] != key:
+                    self.replacements += 1
+                    # the evicted entry still gets a second chance below
+                    if self.always_slots is not None:
+                        self.always_slots[idx] = old
+                self.depth_slots[idx] = entry
+                return
+            if self.always_slots is None:
+                return
+
+        old = self.always_slots[idx]
+        if old is not None and old[0] != key:
+            self.replacements += 1
+        self.always_slots[idx] = entry
+
+    def clear(self):
+        """
+        Remove all entries and reset the counters
+        """
+        self.__init__(self.size, self.policy)
+
+    def __len__(self):
+        return sum(1 for slots in (self.depth_slots, self.always_slots)
+                   if slots is not None for entry in slots if entry is not None)
+
+    def stats(self):
+        """
+        Return the hit/miss/collision counters and table usage as a dict
+        """
+        probes = self.hits + self.misses
+        return {
+            'size': self.size,
+            'policy': self.policy,
+            'entries': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'collisions': self.collisions,
+            'stores': self.stores,
+            'replacements': self.replacements,
+            'hit_rate': self.hits / probes if probes else 0.0,
+        }